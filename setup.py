@@ -6,5 +6,7 @@ setup(name='prices',
       author='wurdum',
       author_email='wurdum.my@gmail.com',
       url='http://www.python.org/sigs/distutils-sig/',
-      install_requires=['Flask>=0.7.2', 'beautifulsoup4>=4.2.0', 'pymongo>=2.5.1', 'eventlet'],
+      install_requires=['Flask>=0.7.2', 'beautifulsoup4>=4.2.0', 'pymongo>=2.7,<3.0', 'eventlet',
+                        'lxml'],
+      tests_require=['mongomock<3.15'],
 )
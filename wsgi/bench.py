@@ -0,0 +1,152 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+import db
+import metrics
+import scrapers
+import httpcache
+import transport
+import scheduler
+import extractors
+from fixtures import FixtureArchive, RecordingTransport, ReplayServer
+
+FIXTURES_DIR = os.path.join(httpcache.DATA_DIR, 'fixtures')
+UNTHROTTLED_POLICY = {'start': 1000, 'min': 1000, 'max': 1000, 'rate': 1e6, 'burst': 1e6, 'latency': 1e6}
+# magiccards search and card pages, set listings and sitemap aren't card pages
+MAGICCARDS_PAGE_RE = re.compile(re.escape(extractors.MAGICCARDS_BASE_URL) + r'(query\?|[^/]+/[^/]+/[^/]+\.html$)')
+
+
+def fixture_path(shop, reda):
+    """
+    Returns default archive path of shop redaction recording
+    """
+    return os.path.join(FIXTURES_DIR, '%s-%s.zip' % (shop, reda.replace(' ', '_')))
+
+
+def record(shop_scraper, reda, path=None, cold=True):
+    """Scrapes redaction from live sites and records every fetched response into fixture archive
+
+    :param shop_scraper: scraper class, e.g. scrapers.SpellShopScraper
+    :param reda: models.Redaction
+    :param path: archive path, default is in FIXTURES_DIR
+    :param cold: if True cards, failures and catalog stored in db are ignored, so every card is resolved
+        by magiccards and every magiccards page is recorded
+    :return: archive path
+    """
+    path = path or fixture_path(shop_scraper.SHOP_NAME, reda.name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    archive = FixtureArchive({'shop': shop_scraper.SHOP_NAME, 'reda': db.todict(reda), 'cold': cold})
+    with _scrapers_transport(RecordingTransport(transport.Transport(), archive)):
+        list(shop_scraper.get_cards(reda, resolver=_get_resolver(reda, cold)))
+
+    archive.save(path)
+    return path
+
+
+def run(shops, path, latency=0., save=False, throttled=True):
+    """Replays recorded redaction scrape against local stand-in server and measures it
+
+    :param shops: list of scraper classes
+    :param path: fixture archive path
+    :param latency: seconds injected before every replayed response
+    :param save: if True scraped cards are saved to db and save time is included
+    :param throttled: if False per-host scheduler limits are lifted
+    :return: dict with shop, redaction, cards, wall, fetches, parse, db, missed
+    """
+    archive = FixtureArchive.load(path)
+    shop_name = archive.meta['shop']
+    shop_scraper = [sh for sh in shops if sh.SHOP_NAME == shop_name][0]
+    reda = db.toreda(archive.meta['reda'])
+
+    server = ReplayServer(archive, latency).start()
+    fetch_scheduler = scheduler.Scheduler() if throttled else scheduler.Scheduler({}, UNTHROTTLED_POLICY)
+    replay = transport.Transport(scheduler=fetch_scheduler, connect_to=server.address)
+
+    metrics.reset()
+    started = time.time()
+    try:
+        with _scrapers_transport(replay):
+            cards = list(shop_scraper.get_cards(reda, resolver=_get_resolver(reda, archive.meta['cold'])))
+        if save:
+            with metrics.timed('db'):
+                db.save_cards(cards, shop=shop_name)
+    finally:
+        server.stop()
+
+    return {'shop': shop_name,
+            'redaction': reda.name,
+            'cards': len(cards),
+            'wall': time.time() - started,
+            'fetches': sum(host_stats['fetches'] for host_stats in replay.stats.values()),
+            'parse': metrics.timings['parse'],
+            'db': metrics.timings['db'],
+            'missed': len(server.missed)}
+
+
+def _get_resolver(reda, cold):
+    """
+    Creates resolver that doesn't write to db, cold one starts with empty cards, failures and catalog
+    """
+    if cold:
+        return scrapers.CardResolver(reda.name, known_cards={}, failures={}, catalog={}, persist=False)
+    return scrapers.CardResolver(reda.name, persist=False)
+
+
+def parse(path, repeat=10):
+    """Measures CPU time of magiccards pages recorded in fixture archive: extraction of pages
+    against their bare parse, the floor any extraction pays, and against whole tree walks
+    magiccards scraper did before pages were extracted in one pass
+
+    :param path: fixture archive path
+    :param repeat: number of times every page is parsed
+    :return: dict with pages, parse, extracted and walked CPU seconds spent on all pages
+    """
+    archive = FixtureArchive.load(path)
+    pages = [response['body'] for url, response in archive.responses.items()
+             if response['status'] == 200 and MAGICCARDS_PAGE_RE.match(url)]
+
+    def measure(func):
+        started = time.clock()
+        for _ in xrange(repeat):
+            for page in pages:
+                func(page)
+        return time.clock() - started
+
+    return {'pages': len(pages),
+            'parse': measure(lambda page: extractors.parse_html(page).decompose()),
+            'extracted': measure(extractors.extract_magiccards_page),
+            'walked': measure(_walk_magiccards_page)}
+
+
+def _walk_magiccards_page(page):
+    """
+    Looks card page up the way magiccards scraper did: every check walked the whole tree again
+    """
+    soup = extractors.parse_html(page)
+    if len(soup.find_all('table')) <= 2:
+        return [hint_li.contents[0] for hint_li in soup.find_all('li')]
+
+    en_img = soup.find_all('table')[3].find_all('td')[2].find('img', alt='English')
+    if en_img is None or list(en_img.next_elements)[1].name != 'b':
+        return None
+
+    return (soup.find_all('table')[3].find_all('td')[2].find_all('b'),
+            soup.find_all('table')[3].find_all('td')[2].find_all('b'),
+            soup.find_all('table')[3].find_all('a')[0], soup.find_all('table')[3].find_all('img')[0],
+            soup.find_all('table')[3].find_all('script')[0])
+
+
+@contextmanager
+def _scrapers_transport(http):
+    """
+    Routes scrapers fetches through http transport with responses cache disabled
+    """
+    saved = scrapers.http, scrapers.responses_cache
+    scrapers.http, scrapers.responses_cache = http, httpcache.ResponseCache(policies=[])
+    try:
+        yield
+    finally:
+        scrapers.http, scrapers.responses_cache = saved
@@ -0,0 +1,74 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    In-process cache with least recently used eviction and entries time to live
+    """
+
+    def __init__(self, max_size=256, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns cached value and marks it as recently used
+
+        :param key: hashable key
+        :param default: value returned if key is not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return default
+
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Caches value, evicts least recently used entry if cache is full
+
+        :param key: hashable key
+        :param value: cached value
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, func):
+        """Returns cached value or caches and returns result of func
+
+        :param key: hashable key
+        :param func: callable without arguments that builds value on miss
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = func()
+            self.set(key, value)
+
+        return value
+
+    def clear(self):
+        """
+        Removes all entries, hit/miss counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        """
+        Returns dict with cache size and hit/miss counters
+        """
+        return {'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,77 @@
+import db
+
+
+class Checkpoint(object):
+    """
+    Finished redactions and listing pages of update run and rows that failed,
+    checkpoint of run with id is stored in db, so restarted run skips finished work
+    """
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+        state = db.get_checkpoint(run_id) if run_id is not None else {}
+        self.redas = set(state.get('redas', ()))
+        self.pages = set(state.get('pages', ()))
+        self.failed_rows = len(state.get('failed_rows', ()))
+
+    def is_reda_done(self, shop, reda):
+        """Tells if all listing pages of shop redaction were saved
+
+        :param shop: shop name
+        :param reda: redaction name
+        :return: bool
+        """
+        return _unit(shop, reda) in self.redas
+
+    def reda_done(self, shop, reda):
+        """Records that all listing pages of shop redaction are saved
+
+        :param shop: shop name
+        :param reda: redaction name
+        """
+        self._done('redas', self.redas, _unit(shop, reda))
+
+    def is_page_done(self, shop, url):
+        """Tells if cards of shop listing page were saved
+
+        :param shop: shop name
+        :param url: listing page url
+        :return: bool
+        """
+        return _unit(shop, url) in self.pages
+
+    def page_done(self, shop, url):
+        """Records that cards of shop listing page are saved
+
+        :param shop: shop name
+        :param url: listing page url
+        """
+        self._done('pages', self.pages, _unit(shop, url))
+
+    def row_failed(self, shop, reda, row, error):
+        """Records listing row that couldn't be resolved
+
+        :param shop: shop name
+        :param reda: redaction name
+        :param row: extractors.ShopRow
+        :param error: exception
+        """
+        self.failed_rows += 1
+        if self.run_id is not None:
+            db.save_checkpoint_failed_row(self.run_id, {'shop': shop, 'redaction': reda, 'name': row.name,
+                                                        'url': row.url, 'error': repr(error)})
+
+    def _done(self, field, units, unit):
+        """
+        Adds finished unit to in-memory set and to stored checkpoint of run with id
+        """
+        units.add(unit)
+        if self.run_id is not None:
+            db.save_checkpoint_unit(self.run_id, field, unit)
+
+
+def _unit(shop, key):
+    """
+    Returns checkpoint key of shop redaction or listing page
+    """
+    return u'%s:%s' % (shop, key)
@@ -1,29 +1,162 @@
 import os
+import json
+import base64
+import datetime
+import threading
+from collections import defaultdict
 import pymongo
+from bson.objectid import ObjectId
 import models
+import ext
 
 MONGO_URL = os.environ.get('OPENSHIFT_MONGODB_DB_URL', 'localhost')
+MONGO_POOL_SIZE = int(os.environ.get('PRICES_MONGO_POOL_SIZE', 100))
 DB = os.environ.get('OPENSHIFT_APP_NAME', 'prices')
+SAVE_BATCH_SIZE = 500
+# smaller batches for streamed scrape results, so first cards are stored early
+STREAM_BATCH_SIZE = int(os.environ.get('PRICES_STREAM_BATCH_SIZE', 100))
+FAILURE_TTL = int(os.environ.get('PRICES_FAILURE_TTL', 7 * 24 * 60 * 60))
+JOB_ERRORS_LIMIT = 50
+CHECKPOINT_TTL = int(os.environ.get('PRICES_CHECKPOINT_TTL', 7 * 24 * 60 * 60))
 
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
-def save_cards(cards):
+
+def get_client():
+    """Returns shared pymongo.MongoClient, client is created lazily on first call
+    and recreated after fork, so each wsgi worker has its own sockets pool
+
+    :return: pymongo.MongoClient
     """
-    Saves cards list to db with token as key
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = pymongo.MongoClient(MONGO_URL, max_pool_size=MONGO_POOL_SIZE)
+                _client_pid = pid
+
+    return _client
+
+
+def set_client(client):
+    """Replaces shared client, e.g. with mongomock.MongoClient in tests
+
+    :param client: object with pymongo.MongoClient interface or None to reset
     """
-    connection = pymongo.MongoClient(MONGO_URL)
-    db = connection[DB]
+    global _client, _client_pid
+
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid() if client is not None else None
 
+
+def get_db():
+    """
+    Returns application database from shared client
+    """
+    return get_client()[DB]
+
+
+def save_cards(cards, shop=None, batch_size=SAVE_BATCH_SIZE):
+    """Saves cards to db using unordered bulk upserts keyed by (name, redaction).
+    Only card identity, info, prices and shops.<shop> offers are set, so
+    offers of other shops stored in db are left untouched. Listing counters
+    are incremented by number of offers that weren't stored before
+
+    :param cards: iterable of models.Card
+    :param shop: shop name which offers are saved, if None all card offers are saved
+    :param batch_size: number of cards sent in one bulk
+    :return: dict {inserted, modified, unchanged}
+    """
+    db = get_db()
+
+    report = {'inserted': 0, 'modified': 0, 'unchanged': 0}
+    batch = []
     for card in cards:
-        card_selector = {'name': card.name, 'redaction': card.redaction}
-        dbcard = db.cards.find_one(card_selector)
-        if dbcard is not None:
-            for k, v in tocard(dbcard).shops.items():
-                if k not in card.shops:
-                    card.shops[k] = v
-
-            db.cards.update(card_selector, {'$set': {'shops': todict(card.shops)}})
-        else:
-            db.cards.insert(todict(card))
+        batch.append(card)
+        if len(batch) == batch_size:
+            _save_cards_batch(db, batch, shop, report)
+            batch = []
+
+    if batch:
+        _save_cards_batch(db, batch, shop, report)
+
+    if report['inserted'] or report['modified']:
+        bump_data_version()
+
+    return report
+
+
+def _save_cards_batch(db, cards, shop, report):
+    """Sends one unordered bulk of card upserts and accumulates its result into report
+
+    :param db: pymongo database
+    :param cards: list of models.Card
+    :param shop: shop name which offers are saved, if None all card offers are saved
+    :param report: dict {inserted, modified, unchanged}
+    """
+    offers = set((name, card.name, card.redaction) for card in cards for name in card.shops
+                 if shop is None or name == shop)
+    stored = _get_stored_offers(db, cards, set(name for name, card_name, reda in offers))
+
+    bulk = db.cards.initialize_unordered_bulk_op()
+    for card in cards:
+        bulk.find({'name': card.name, 'redaction': card.redaction}).upsert().update_one(
+            {'$set': card_update(card, shop)})
+
+    result = bulk.execute()
+    modified = result.get('nModified') or 0
+    report['inserted'] += result['nUpserted']
+    report['modified'] += modified
+    report['unchanged'] += result['nMatched'] - modified
+
+    increments = defaultdict(int)
+    for name, card_name, reda in offers - stored:
+        increments[(name, reda)] += 1
+    inc_counters(increments)
+
+
+def _get_stored_offers(db, cards, shops):
+    """Finds which offers of shops are stored already for batch cards
+
+    :param db: pymongo database
+    :param cards: list of models.Card
+    :param shops: set of shop names
+    :return: set of tuples (shop name, card name, redaction name)
+    """
+    if not shops:
+        return set()
+
+    fields = dict([('_id', False), ('name', True), ('redaction', True)] +
+                  [('shops.' + shop + '.url', True) for shop in shops])
+    cursor = db.cards.find({'name': {'$in': list(set(card.name for card in cards))},
+                            'redaction': {'$in': list(set(card.redaction for card in cards))}}, fields)
+    return set((shop, card_dict['name'], card_dict['redaction'])
+               for card_dict in cursor for shop in card_dict.get('shops', {}) if shop in shops)
+
+
+def card_update(card, shop=None):
+    """Builds $set document for card upsert
+
+    :param card: models.Card
+    :param shop: shop name which offer is set, if None all card offers are set
+    :return: dict of field paths and values
+    """
+    fields = {'name': card.name,
+              'redaction': card.redaction,
+              'type': card.type,
+              'info': todict(card.info),
+              'prices': todict(card.prices)}
+
+    for name, offer in card.shops.items():
+        if shop is None or name == shop:
+            fields['shops.' + name] = todict(offer)
+
+    return fields
 
 
 def get_card(name, reda):
@@ -32,13 +165,275 @@ def get_card(name, reda):
     :param name: card name
     :param reda: card redaction
     """
-    connection = pymongo.MongoClient(MONGO_URL)
-    db = connection[DB]
+    db = get_db()
 
     dbcard = db.cards.find_one({'name': name, 'redaction': reda})
     return tocard(dbcard) if dbcard is not None else None
 
 
+def get_known_cards(redas):
+    """Loads all cards of redactions with one query, cursor is streamed in batches
+
+    :param redas: list of redaction names, list of strings
+    :return: dict {(name, redaction): models.Card}
+    """
+    db = get_db()
+
+    cursor = db.cards.find({'redaction': {'$in': list(redas)}})
+    return dict(((card_dict['name'], card_dict['redaction']), tocard(card_dict)) for card_dict in cursor)
+
+
+def save_catalog(reda, entries):
+    """Saves magiccards set listing of redaction with bulk upserts, known tcg sids are kept
+
+    :param reda: redaction name
+    :param entries: list of extractors.CatalogEntry
+    :return: number of saved entries
+    """
+    db = get_db()
+
+    if not entries:
+        return 0
+
+    bulk = db.catalog.initialize_unordered_bulk_op()
+    for entry in entries:
+        fields = dict(entry._asdict(), redaction=reda)
+        bulk.find({'name': entry.name, 'redaction': reda}).upsert().update_one({'$set': fields})
+    bulk.execute()
+    _bump_catalog_version()
+
+    return len(entries)
+
+
+def get_catalog(redas):
+    """Loads catalog entries of redactions
+
+    :param redas: list of redaction names, list of strings
+    :return: dict {(normalized name, redaction): dict with title, url, img_url, rarity and sid if known}
+    """
+    db = get_db()
+
+    cursor = db.catalog.find({'redaction': {'$in': list(redas)}}, {'_id': False})
+    return dict(((entry['name'], entry['redaction']), entry) for entry in cursor)
+
+
+def set_catalog_sid(name, reda, sid):
+    """
+    Stores tcgplayer sid of catalog entry
+    """
+    db = get_db()
+
+    db.catalog.update({'name': name, 'redaction': reda}, {'$set': {'sid': sid}})
+
+
+def get_catalog_version():
+    """Returns stamp of stored catalog, it is changed by every catalog save
+
+    :return: int
+    """
+    db = get_db()
+
+    meta = db.meta.find_one({'_id': 'catalog_version'})
+    return meta['version'] if meta is not None else 0
+
+
+def _bump_catalog_version():
+    get_db().meta.update({'_id': 'catalog_version'}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def save_card_failure(name, reda, reason):
+    """Remembers that card can't be resolved, failure expires after FAILURE_TTL seconds
+
+    :param name: normalized card name
+    :param reda: redaction name
+    :param reason: failure reason
+    """
+    db = get_db()
+
+    now = datetime.datetime.utcnow()
+    db.failures.update({'name': name, 'redaction': reda},
+                       {'$set': {'reason': reason, 'created': now,
+                                 'expires': now + datetime.timedelta(seconds=FAILURE_TTL)}},
+                       upsert=True)
+
+
+def get_card_failures(redas):
+    """Loads not expired failures of redactions
+
+    :param redas: list of redaction names, list of strings
+    :return: dict {(normalized name, redaction): reason}
+    """
+    db = get_db()
+
+    cursor = db.failures.find({'redaction': {'$in': list(redas)}, 'expires': {'$gt': datetime.datetime.utcnow()}})
+    return dict(((failure['name'], failure['redaction']), failure['reason']) for failure in cursor)
+
+
+def purge_card_failures(redas=None, reason=None):
+    """Removes remembered failures, so cards are searched again
+
+    :param redas: list of redaction names, all failures are removed if None
+    :param reason: only failures with this reason are removed if set
+    :return: number of removed failures
+    """
+    db = get_db()
+
+    selector = {}
+    if redas:
+        selector['redaction'] = {'$in': redas}
+    if reason:
+        selector['reason'] = reason
+
+    return db.failures.remove(selector)['n']
+
+
+def get_offer_fingerprints(shop, reda):
+    """Loads listing row fingerprints of stored shop offers of redaction
+
+    :param shop: shop name
+    :param reda: redaction name
+    :return: dict {offer url: (card name, fingerprint or None)}
+    """
+    db = get_db()
+
+    offer = 'shops.' + shop
+    cursor = db.cards.find({'redaction': reda, offer: {'$exists': 1}},
+                           {'_id': False, 'name': True, offer + '.url': True, offer + '.fingerprint': True})
+    return dict((card['shops'][shop]['url'], (card['name'], card['shops'][shop].get('fingerprint')))
+                for card in cursor)
+
+
+def remove_shop_offers(shop, reda, offers):
+    """Removes shop offers of redaction cards with one unordered bulk and decrements shop counters.
+    Offer is removed only if it still has the given url, so offer saved with new url is kept
+
+    :param shop: shop name
+    :param reda: redaction name
+    :param offers: list of tuples (card name, offer url)
+    :return: number of removed offers
+    """
+    db = get_db()
+
+    if not offers:
+        return 0
+
+    bulk = db.cards.initialize_unordered_bulk_op()
+    for name, url in offers:
+        bulk.find({'name': name, 'redaction': reda, 'shops.%s.url' % shop: url}) \
+            .update_one({'$unset': {'shops.' + shop: ''}})
+    removed = bulk.execute().get('nModified') or 0
+
+    if removed:
+        inc_counters({(shop, reda): -removed})
+        bump_data_version()
+    return removed
+
+
+def get_stale_cards(max_age, limit):
+    """Returns cards which prices are older than max_age or have no fetch time, most valuable first
+
+    :param max_age: prices age in seconds
+    :param limit: max number of cards
+    :return: list of models.Card
+    """
+    db = get_db()
+
+    threshold = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+    selector = {'prices.sid': {'$exists': 1},
+                '$or': [{'prices.updated': {'$lt': threshold}}, {'prices.updated': {'$exists': 0}}]}
+    cursor = db.cards.find(selector).sort([('prices.mid', pymongo.DESCENDING)]).limit(limit)
+    return [tocard(card_dict) for card_dict in cursor]
+
+
+def save_prices(cards):
+    """Saves prices and shop offers overpay of cards with one unordered bulk
+
+    :param cards: list of models.Card
+    """
+    db = get_db()
+
+    if not cards:
+        return
+
+    bulk = db.cards.initialize_unordered_bulk_op()
+    for card in cards:
+        fields = {'prices': todict(card.prices)}
+        for name, offer in card.shops.items():
+            fields['shops.' + name + '.overpay'] = offer.overpay
+        bulk.find({'name': card.name, 'redaction': card.redaction}).update_one({'$set': fields})
+    bulk.execute()
+
+    bump_data_version()
+
+
+def get_uah_rate():
+    """Returns uah for one dollar used to convert shop prices, ext.UAH_RATE until rate is stored
+
+    :return: float
+    """
+    db = get_db()
+
+    meta = db.meta.find_one({'_id': 'uah_rate'})
+    return meta['rate'] if meta is not None else ext.UAH_RATE
+
+
+def set_uah_rate(rate):
+    """
+    Stores uah for one dollar, it is used by following scrapes and overpay recomputations
+    """
+    db = get_db()
+
+    db.meta.update({'_id': 'uah_rate'}, {'$set': {'rate': float(rate)}}, upsert=True)
+
+
+def recompute_overpay():
+    """Recomputes overpay of all shop offers by stored prices without scraping, dollar prices
+    are recomputed from uah prices by stored rate. Cards are streamed
+    and only changed offers are written back with unordered bulks of SAVE_BATCH_SIZE
+
+    :return: dict {cards, modified}
+    """
+    db = get_db()
+
+    uah_rate = get_uah_rate()
+
+    cursor = db.cards.find({'prices': {'$ne': None}}, ['name', 'redaction', 'type', 'prices', 'shops'])
+    stats = {'cards': 0, 'modified': 0}
+    batch = []
+    for card_dict in cursor:
+        stats['cards'] += 1
+        card = tocard(card_dict)
+        if card.refresh_overpay(uah_rate):
+            batch.append(card)
+        if len(batch) >= SAVE_BATCH_SIZE:
+            stats['modified'] += _save_offers_batch(batch)
+            batch = []
+
+    if batch:
+        stats['modified'] += _save_offers_batch(batch)
+    if stats['modified']:
+        bump_data_version()
+
+    return stats
+
+
+def _save_offers_batch(cards):
+    """Sends one unordered bulk of shop offers price and overpay updates
+
+    :param cards: list of models.Card
+    :return: number of modified cards
+    """
+    bulk = get_db().cards.initialize_unordered_bulk_op()
+    for card in cards:
+        fields = {}
+        for name, offer in card.shops.items():
+            fields['shops.' + name + '.price'] = offer.price
+            fields['shops.' + name + '.overpay'] = offer.overpay
+        bulk.find({'name': card.name, 'redaction': card.redaction}).update_one({'$set': fields})
+
+    return bulk.execute().get('nModified') or 0
+
+
 def get_cards(shop, redas=None, skip=0, limit=40):
     """Returns all cards from db as list of models.Card
 
@@ -48,18 +443,87 @@ def get_cards(shop, redas=None, skip=0, limit=40):
     :param limit: number of cards in result list
     :return: list of models.Card
     """
-    connection = pymongo.MongoClient(MONGO_URL)
-    db = connection[DB]
+    db = get_db()
 
-    selector = {'shops.' + shop: {'$exists': 1}}
-    if redas:
-        selector['redaction'] = {'$in': redas}
-
-    sort = [['shops.' + shop + '.overpay', pymongo.DESCENDING]]
+    selector = _cards_selector(shop, redas)
+    sort = _cards_sort(shop)
 
     return [tocard(card_dict) for card_dict in db.cards.find(selector).sort(sort).skip(skip).limit(limit)]
 
 
+def get_cards_page(shop, redas=None, skip=0, limit=40, after=None, before=None):
+    """Returns page of cards sorted by overpay, page position is set either
+    by continuation token (keyset pagination on (overpay, _id)) or by skip
+
+    :param shop: shop name
+    :param redas: list of redaction for which cards will be searched, list of strings
+    :param skip: number of cards that will be skipped, ignored if token is passed
+    :param limit: number of cards in result list
+    :param after: token of the last card of previous page
+    :param before: token of the first card of next page
+    :return: tuple (list of models.Card, token of first card, token of last card)
+    """
+    db = get_db()
+
+    selector, sort = _cards_page_query(shop, redas, after, before)
+    if after or before:
+        skip = 0
+
+    card_dicts = list(db.cards.find(selector).sort(sort).skip(skip).limit(limit))
+    if before:
+        card_dicts.reverse()
+
+    if not card_dicts:
+        return [], None, None
+
+    return ([tocard(card_dict) for card_dict in card_dicts],
+            _encode_page_token(shop, card_dicts[0]), _encode_page_token(shop, card_dicts[-1]))
+
+
+def _cards_page_query(shop, redas, after=None, before=None):
+    """Builds selector and sort of shop listing page, page after token is selected
+    by overpay and _id lower than token ones, page before it by greater ones in reversed order
+
+    :return: tuple (selector, sort)
+    """
+    selector = _cards_selector(shop, redas)
+    sort = _cards_sort(shop)
+
+    token = after or before
+    if token:
+        overpay, card_id = _decode_page_token(token)
+        op = '$lt' if after else '$gt'
+        overpay_key = 'shops.' + shop + '.overpay'
+        selector['$or'] = [{overpay_key: {op: overpay}},
+                           {overpay_key: overpay, '_id': {op: card_id}}]
+        if before:
+            sort = [[key, -direction] for key, direction in sort]
+
+    return selector, sort
+
+
+def _encode_page_token(shop, card_dict):
+    """
+    Encodes card position in shop listing as opaque url-safe string
+    """
+    position = [card_dict['shops'][shop]['overpay'], str(card_dict['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(position))
+
+
+def _decode_page_token(token):
+    """Decodes card position in shop listing
+
+    :param token: string created by _encode_page_token
+    :return: tuple (overpay, ObjectId)
+    :raise ValueError: if token is malformed
+    """
+    try:
+        overpay, card_id = json.loads(base64.urlsafe_b64decode(str(token)))
+        return float(overpay), ObjectId(card_id)
+    except Exception:
+        raise ValueError('malformed page token: ' + token)
+
+
 def get_cards_count(shop=None, redas=None):
     """Returns number of cards in db
 
@@ -67,29 +531,134 @@ def get_cards_count(shop=None, redas=None):
     :param redas: list of redaction for which cards will be searched, list of strings
     :return: int
     """
-    connection = pymongo.MongoClient(MONGO_URL)
-    db = connection[DB]
+    db = get_db()
+
+    if shop and (not redas or len(redas) == 1):
+        counter = db.counters.find_one({'_id': _counter_id(shop, redas[0] if redas else None)})
+        if counter is not None:
+            return counter['count']
+
+    return db.cards.find(_cards_selector(shop, redas)).count()
+
+
+def update_counters(shop_redas):
+    """Recounts cards of (shop, redaction) pairs and refreshes totals of their shops
+
+    :param shop_redas: iterable of tuples (shop name, redaction name)
+    """
+    db = get_db()
+
+    shop_redas = set(shop_redas)
+    if not shop_redas:
+        return
+
+    bulk = db.counters.initialize_unordered_bulk_op()
+    for shop, reda in shop_redas:
+        count = db.cards.find(_cards_selector(shop, [reda])).count()
+        bulk.find({'_id': _counter_id(shop, reda)}).upsert().update_one(
+            {'$set': {'shop': shop, 'redaction': reda, 'count': count}})
+    bulk.execute()
+
+    _update_shops_totals(db, set(shop for shop, reda in shop_redas))
+
+
+def inc_counters(increments):
+    """Adds changes of card numbers to (shop, redaction) counters and to shop totals with one unordered bulk.
+    Counter that doesn't exist yet is seeded by real count of stored cards, which already includes the change,
+    so cards stored before counters were kept are counted too
+
+    :param increments: dict {(shop name, redaction name): number of added cards, negative for removed}
+    """
+    db = get_db()
+
+    counters = defaultdict(int)
+    for (shop, reda), count in increments.items():
+        if count:
+            counters[(shop, reda)] += count
+            counters[(shop, None)] += count
+
+    if not counters:
+        return
+
+    existing = set(counter['_id'] for counter in
+                   db.counters.find({'_id': {'$in': [_counter_id(shop, reda) for shop, reda in counters]}},
+                                    {'_id': True}))
+    bulk = db.counters.initialize_unordered_bulk_op()
+    for (shop, reda), count in counters.items():
+        counter_id = _counter_id(shop, reda)
+        if counter_id in existing:
+            update = {'$set': {'shop': shop, 'redaction': reda}, '$inc': {'count': count}}
+        else:
+            count = db.cards.find(_cards_selector(shop, [reda] if reda is not None else None)).count()
+            update = {'$set': {'shop': shop, 'redaction': reda, 'count': count}}
+        bulk.find({'_id': counter_id}).upsert().update_one(update)
+    bulk.execute()
+
+
+def reconcile_counters(shops):
+    """Drops all counters and recounts them from scratch
+
+    :param shops: list of shop names, list of strings
+    """
+    db = get_db()
+
+    db.counters.remove()
+    for shop in shops:
+        redas = db.cards.find(_cards_selector(shop)).distinct('redaction')
+        update_counters((shop, reda) for reda in redas)
+
+    bump_data_version()
+
+
+def _update_shops_totals(db, shops):
+    """
+    Sums redaction counters of shops into shop total counters
+    """
+    for shop in shops:
+        total = sum(counter['count'] for counter in db.counters.find({'shop': shop, 'redaction': {'$ne': None}}))
+        db.counters.update({'_id': _counter_id(shop)}, {'$set': {'shop': shop, 'redaction': None, 'count': total}},
+                           upsert=True)
+
 
+def _counter_id(shop, reda=None):
+    """
+    Returns counter key of shop total or of (shop, redaction) pair
+    """
+    return shop if reda is None else shop + ':' + reda
+
+
+def _cards_selector(shop=None, redas=None):
+    """
+    Builds cards query selector for shop listing
+    """
     selector = {}
     if shop:
         selector['shops.' + shop] = {'$exists': 1}
     if redas:
         selector['redaction'] = {'$in': redas}
 
-    return db.cards.find(selector).count()
+    return selector
+
+
+def _cards_sort(shop):
+    """
+    Builds cards sort specification for shop listing
+    """
+    return [['shops.' + shop + '.overpay', pymongo.DESCENDING], ['_id', pymongo.DESCENDING]]
 
 
 def save_redas(redas):
     """
     Removes old and saves new redactions list to db
     """
-    connection = pymongo.MongoClient(MONGO_URL)
-    db = connection[DB]
+    db = get_db()
 
     db.redas.remove()
     for reda in redas:
         db.redas.insert(todict(reda))
 
+    bump_data_version()
+
 
 def get_redas(name=None):
     """
@@ -98,13 +667,313 @@ def get_redas(name=None):
     :param name: redaction name that will be searched
     :return: list of models.Redaction
     """
-    connection = pymongo.MongoClient(MONGO_URL)
-    db = connection[DB]
+    db = get_db()
 
     selector = {} if name is None else {'name': name}
     return [toreda(reda_dict) for reda_dict in db.redas.find(selector)]
 
 
+def enqueue_job(kind, shop, reda):
+    """Queues job, if job of the same kind, shop and redaction is queued or running already
+    request is merged into it
+
+    :param kind: job kind, 'cards' or 'redas'
+    :param shop: shop name or None for all shops
+    :param reda: redaction name or 'all'
+    :return: job dict
+    """
+    db = get_db()
+
+    now = datetime.datetime.utcnow()
+    return db.jobs.find_and_modify({'kind': kind, 'shop': shop, 'reda': reda, 'state': {'$in': ['queued', 'running']}},
+                                   {'$setOnInsert': {'state': 'queued', 'created': now, 'progress': {}},
+                                    '$inc': {'requests': 1}},
+                                   upsert=True, new=True)
+
+
+def claim_job(worker):
+    """Marks the oldest queued job as running by worker
+
+    :param worker: worker name
+    :return: job dict or None if queue is empty
+    """
+    db = get_db()
+
+    now = datetime.datetime.utcnow()
+    return db.jobs.find_and_modify({'state': 'queued'},
+                                   {'$set': {'state': 'running', 'worker': worker, 'started': now, 'heartbeat': now}},
+                                   sort=[('created', pymongo.ASCENDING)], new=True)
+
+
+def update_job_progress(job_id, progress):
+    """
+    Saves job progress dict and marks job as alive
+    """
+    db = get_db()
+
+    db.jobs.update({'_id': job_id}, {'$set': {'progress': progress, 'heartbeat': datetime.datetime.utcnow()}})
+
+
+def add_job_error(job_id, reda, error):
+    """Records error of job redaction, only the last JOB_ERRORS_LIMIT errors are kept
+
+    :param job_id: job id
+    :param reda: redaction name
+    :param error: error description string
+    """
+    db = get_db()
+
+    db.jobs.update({'_id': job_id}, {'$push': {'errors': {'$each': [{'redaction': reda, 'error': error}],
+                                                          '$slice': -JOB_ERRORS_LIMIT}}})
+
+
+def finish_job(job_id, error=None):
+    """
+    Marks job as done or as failed if error is given
+    """
+    db = get_db()
+
+    db.jobs.update({'_id': job_id}, {'$set': {'state': 'failed' if error else 'done', 'error': error,
+                                              'finished': datetime.datetime.utcnow()}})
+
+
+def requeue_stale_jobs(timeout):
+    """Queues again running jobs which worker didn't report progress for timeout seconds
+
+    :param timeout: seconds
+    :return: number of requeued jobs
+    """
+    db = get_db()
+
+    threshold = datetime.datetime.utcnow() - datetime.timedelta(seconds=timeout)
+    result = db.jobs.update({'state': 'running', 'heartbeat': {'$lt': threshold}},
+                            {'$set': {'state': 'queued'}}, multi=True)
+    return result['n']
+
+
+def requeue_job(job_id):
+    """Queues finished or failed job again, it resumes from its checkpoint
+
+    :param job_id: job id string
+    :return: True if job was requeued
+    """
+    db = get_db()
+
+    if not ObjectId.is_valid(job_id):
+        return False
+    result = db.jobs.update({'_id': ObjectId(job_id), 'state': {'$in': ['done', 'failed']}},
+                            {'$set': {'state': 'queued'}})
+    return result['n'] > 0
+
+
+def get_job(job_id):
+    """Loads job by id
+
+    :param job_id: job id string
+    :return: job dict or None if job id is unknown or malformed
+    """
+    db = get_db()
+
+    if not ObjectId.is_valid(job_id):
+        return None
+    return db.jobs.find_one({'_id': ObjectId(job_id)})
+
+
+def get_jobs(limit=20):
+    """
+    Loads recent jobs, newest first
+    """
+    db = get_db()
+
+    return list(db.jobs.find().sort([('created', pymongo.DESCENDING)]).limit(limit))
+
+
+def get_checkpoint(run_id):
+    """Loads checkpoint of update run
+
+    :param run_id: id of run, e.g. job id
+    :return: dict {redas, pages, failed_rows}, lists are empty for unknown run
+    """
+    db = get_db()
+
+    checkpoint = db.checkpoints.find_one({'_id': run_id}) or {}
+    return {'redas': checkpoint.get('redas', []), 'pages': checkpoint.get('pages', []),
+            'failed_rows': checkpoint.get('failed_rows', [])}
+
+
+def save_checkpoint_unit(run_id, field, unit):
+    """Adds finished unit of work to run checkpoint, checkpoint expires
+    CHECKPOINT_TTL seconds after its last change
+
+    :param run_id: id of run
+    :param field: 'redas' or 'pages'
+    :param unit: unit key string
+    """
+    db = get_db()
+
+    db.checkpoints.update({'_id': run_id}, {'$addToSet': {field: unit}, '$set': _checkpoint_expires()}, upsert=True)
+
+
+def save_checkpoint_failed_row(run_id, row):
+    """
+    Adds dict of row that failed after retries to run checkpoint
+    """
+    db = get_db()
+
+    db.checkpoints.update({'_id': run_id}, {'$push': {'failed_rows': row}, '$set': _checkpoint_expires()}, upsert=True)
+
+
+def _checkpoint_expires():
+    return {'expires': datetime.datetime.utcnow() + datetime.timedelta(seconds=CHECKPOINT_TTL)}
+
+
+def save_freshness(shop, reda, report, fetches):
+    """Records refresh of shop redaction listing: time, fetch cost, max overpay
+    and volatility, which is share of changed rows smoothed over runs
+
+    :param shop: shop name
+    :param reda: redaction name
+    :param report: dict {new, changed, unchanged, delisted}
+    :param fetches: number of fetches spent
+    """
+    db = get_db()
+
+    rows = report['new'] + report['changed'] + report['unchanged']
+    changes = report['new'] + report['changed'] + report['delisted']
+    previous = db.freshness.find_one({'_id': _counter_id(shop, reda)}) or {}
+    volatility = float(changes) / max(rows + report['delisted'], 1)
+    if 'volatility' in previous:
+        volatility = (previous['volatility'] + volatility) / 2
+
+    top = list(db.cards.find(_cards_selector(shop, [reda]), {'_id': False, 'shops.' + shop + '.overpay': True})
+               .sort(_cards_sort(shop)).limit(1))
+    db.freshness.update({'_id': _counter_id(shop, reda)},
+                        {'$set': {'shop': shop, 'redaction': reda, 'refreshed': datetime.datetime.utcnow(),
+                                  'rows': rows, 'changes': changes, 'volatility': volatility, 'cost': fetches,
+                                  'max_overpay': top[0]['shops'][shop]['overpay'] if top else 0.}},
+                        upsert=True)
+
+
+def get_freshness():
+    """Loads refresh records of shop redaction listings
+
+    :return: dict {(shop name, redaction name): dict {refreshed, rows, changes, volatility, cost, max_overpay}}
+    """
+    db = get_db()
+
+    return dict(((state['shop'], state['redaction']), state) for state in db.freshness.find())
+
+
+def get_data_version():
+    """Returns stamp of stored data, it is changed by every write of cards or redactions
+
+    :return: int
+    """
+    db = get_db()
+
+    meta = db.meta.find_one({'_id': 'data_version'})
+    return meta['version'] if meta is not None else 0
+
+
+def bump_data_version():
+    """
+    Changes stamp of stored data, so caches built on previous stamp become stale
+    """
+    db = get_db()
+
+    db.meta.update({'_id': 'data_version'}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def ensure_indexes(shops):
+    """Creates indexes used by db queries, existing indexes are left as is
+
+    :param shops: list of shop names, list of strings
+    """
+    db = get_db()
+
+    db.cards.create_index([('name', pymongo.ASCENDING), ('redaction', pymongo.ASCENDING)], unique=True)
+    for shop in shops:
+        overpay = 'shops.' + shop + '.overpay'
+        db.cards.create_index([('redaction', pymongo.ASCENDING), (overpay, pymongo.DESCENDING),
+                               ('_id', pymongo.DESCENDING)])
+        db.cards.create_index([(overpay, pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+
+    db.cards.create_index([('prices.mid', pymongo.DESCENDING)])
+    db.redas.create_index('name')
+    db.catalog.create_index([('redaction', pymongo.ASCENDING), ('name', pymongo.ASCENDING)], unique=True)
+    db.failures.create_index([('name', pymongo.ASCENDING), ('redaction', pymongo.ASCENDING)], unique=True)
+    db.failures.create_index([('redaction', pymongo.ASCENDING)])
+    db.failures.create_index('expires', expireAfterSeconds=0)
+    db.checkpoints.create_index('expires', expireAfterSeconds=0)
+    db.jobs.create_index([('kind', pymongo.ASCENDING), ('shop', pymongo.ASCENDING), ('reda', pymongo.ASCENDING),
+                          ('state', pymongo.ASCENDING)])
+    db.jobs.create_index([('state', pymongo.ASCENDING), ('created', pymongo.ASCENDING)])
+
+
+def check_query_plans(shops, reda='sample'):
+    """Explains queries made by this module and raises exception
+    if any of them uses collection scan or in-memory sort
+
+    :param shops: list of shop names, list of strings
+    :param reda: redaction name used in query samples
+    """
+    db = get_db()
+
+    queries = {'get_card': db.cards.find({'name': 'sample', 'redaction': reda}),
+               'get_known_cards': db.cards.find({'redaction': {'$in': [reda]}}),
+               'get_redas': db.redas.find({'name': reda}),
+               'get_catalog': db.catalog.find({'redaction': {'$in': [reda]}}),
+               'get_card_failures': db.failures.find({'redaction': {'$in': [reda]},
+                                                      'expires': {'$gt': datetime.datetime.utcnow()}})}
+    for shop in shops:
+        for redas in [None, [reda]]:
+            query_name = 'get_cards(%s, %s)' % (shop, redas)
+            queries[query_name] = db.cards.find(_cards_selector(shop, redas)).sort(_cards_sort(shop))
+
+            token = _encode_page_token(shop, {'shops': {shop: {'overpay': 1.}}, '_id': ObjectId()})
+            for direction in ['after', 'before']:
+                selector, sort = _cards_page_query(shop, redas, **{direction: token})
+                query_name = 'get_cards_page(%s, %s, %s)' % (shop, redas, direction)
+                queries[query_name] = db.cards.find(selector).sort(sort)
+
+    failed = []
+    for query_name, cursor in sorted(queries.items()):
+        stages = _get_plan_stages(cursor.explain())
+        bad_stages = [stage for stage in ['COLLSCAN', 'SORT'] if stage in stages]
+        if bad_stages:
+            failed.append('%s: %s' % (query_name, ', '.join(bad_stages)))
+
+    if failed:
+        raise Exception('queries are not covered by indexes: ' + '; '.join(failed))
+
+
+def _get_plan_stages(explain):
+    """Returns set of stages names of the winning plan,
+    legacy (mongodb < 3.0) explain output is translated to the same names
+
+    :param explain: result of cursor.explain()
+    :return: set of strings
+    """
+    if 'queryPlanner' not in explain:
+        stages = set()
+        if explain.get('cursor', '').startswith('BasicCursor'):
+            stages.add('COLLSCAN')
+        if explain.get('scanAndOrder'):
+            stages.add('SORT')
+        return stages
+
+    stages = set()
+    plans = [explain['queryPlanner']['winningPlan']]
+    while plans:
+        plan = plans.pop()
+        stages.add(plan['stage'])
+        if 'inputStage' in plan:
+            plans.append(plan['inputStage'])
+        plans.extend(plan.get('inputStages', []))
+
+    return stages
+
+
 def tocard(dict_card):
     """
     Converts dict to models.Card
@@ -1,7 +1,11 @@
 # coding=utf-8
+import os
 import re
 import urlparse
 
+# uah for one dollar until other rate is stored in db
+UAH_RATE = float(os.environ.get('PRICES_UAH_RATE', 8.0))
+
 
 def uni(value):
     """
@@ -12,6 +16,14 @@ def uni(value):
     return value.strip().lower()
 
 
+def normalize_name(value):
+    """
+    Makes card name unicode, lowers it and collapses whitespaces and apostrophes variants
+    """
+    value = uni(value).replace(u'\u2019', u"'").replace(u'`', u"'")
+    return u' '.join(value.split())
+
+
 def urlEncodeNonAscii(b):
     """
     Replaces non ascii symbols with encoded
@@ -27,14 +39,24 @@ def iriToUri(iri):
     return urlparse.urlunparse(urlEncodeNonAscii(part.encode('utf-8')) for parti, part in enumerate(parts))
 
 
-def uah_to_dollar(uah):
-    """Converts uah price to dollar representation
+def uah_to_float(uah):
+    """Converts uah price to float
 
     :param uah: price in format 999.99 грн.
+    :return: price as float
+    """
+    return float(uah.split()[0])
+
+
+def uah_to_dollar(uah, rate=None):
+    """Converts uah price to dollar representation
+
+    :param uah: price in format 999.99 грн. or float
+    :param rate: uah for one dollar, UAH_RATE by default
     :return: price in format $999.99
     """
-    uah_float_price = float(uah.split()[0])
-    dollar_float_price = uah_float_price / 8.0
+    uah_float_price = uah if isinstance(uah, float) else uah_to_float(uah)
+    dollar_float_price = uah_float_price / (rate or UAH_RATE)
     return '$%0.2f' % dollar_float_price
 
 
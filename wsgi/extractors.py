@@ -0,0 +1,250 @@
+# coding=utf-8
+from collections import namedtuple
+from bs4 import BeautifulSoup, Tag
+import ext
+
+HTML_PARSER = 'lxml'
+
+# base urls of parsed sites, scrapers use them too
+MAGICCARDS_BASE_URL = 'http://magiccards.info/'
+SPELLSHOP_BASE_URL = 'http://spellshop.com.ua/index.php?categoryID=90'
+BUYMAGIC_BASE_URL = 'http://www.buymagic.com.ua/'
+
+# parsed magiccards page: search page has only hints as (text, href), card page has
+# english version link (text, href) if it isn't english (None if card has no english version)
+# and printings as (redaction, href),
+# english card page has also redaction, rarity, card url, image url and tcgplayer sid
+MagiccardsPage = namedtuple('MagiccardsPage', ['is_card', 'hints', 'is_en', 'en_link', 'printings',
+                                               'redaction', 'rarity', 'url', 'img_url', 'sid'])
+# card of magiccards set listing, name is normalized and title is name as it's shown
+CatalogEntry = namedtuple('CatalogEntry', ['name', 'title', 'url', 'img_url', 'rarity'])
+# card offer row of shop listing, price is in dollars and uah_price is price as shop shows it
+ShopRow = namedtuple('ShopRow', ['name', 'url', 'price', 'number', 'uah_price'])
+
+
+def parse_html(page, **kwargs):
+    """
+    Builds soup of page with lxml parser
+    """
+    return BeautifulSoup(page, HTML_PARSER, **kwargs)
+
+
+def extract_magiccards_page(page):
+    """Parses magiccards page in one pass, whole page is parsed, because restricting parse
+    with SoupStrainer costs more CPU with lxml than it saves (see manage.py bench-parse).
+    Card details are extracted only from english card page
+
+    :param page: page html
+    :return: MagiccardsPage
+    """
+    soup = parse_html(page)
+    try:
+        tables = soup.find_all('table')
+        if len(tables) <= 2:
+            hints = tuple((hint_li.contents[0].text, hint_li.contents[0]['href']) for hint_li in soup.find_all('li'))
+            return MagiccardsPage(False, hints, None, None, (), None, None, None, None, None)
+
+        content_table = tables[3]
+        redas_td = content_table.find_all('td')[2]
+        printings = tuple((reda_tag.text.strip().lower(), reda_tag['href']) for reda_tag in redas_td.find_all('a'))
+
+        en_img = redas_td.find('img', alt='English')
+        if en_img is None:
+            return MagiccardsPage(True, (), False, None, printings, None, None, None, None, None)
+
+        en_tag = list(en_img.next_elements)[1]
+        if en_tag.name != 'b':
+            return MagiccardsPage(True, (), False, (en_tag.text, en_tag['href']), printings,
+                                  None, None, None, None, None)
+
+        redas_bs = redas_td.find_all('b')
+        # for double sided card 4
+        reda_index = 3 if len(redas_bs) == 5 else 4
+        reda_text = redas_bs[reda_index].text
+        sid_url = content_table.find_all('script')[0]['src']
+
+        return MagiccardsPage(True, (), True, None, printings,
+                              ext.uni(reda_text.split('(')[0]), ext.uni(reda_text.split('(')[1][:-1]),
+                              ext.url_join(MAGICCARDS_BASE_URL, content_table.find_all('a')[0]['href']),
+                              content_table.find_all('img')[0]['src'],
+                              ext.uni(ext.get_query_string_params(sid_url)['sid']))
+    finally:
+        soup.decompose()
+
+
+def extract_magiccards_set(page):
+    """Parses magiccards set listing, rows of cards table are 'even'/'odd' classed
+
+    :param page: page html
+    :return: list of CatalogEntry
+    """
+    soup = parse_html(page)
+    try:
+        entries = []
+        for card_tr in soup.find_all('tr', class_=['even', 'odd']):
+            card_tds = card_tr.find_all('td')
+            card_a = card_tds[1].find('a') if len(card_tds) > 4 else None
+            if card_a is None:
+                continue
+
+            # card href is /<set>/<lang>/<number>.html, scan is /scans/<lang>/<set>/<number>.jpg
+            href_parts = card_a['href'].strip('/').split('/')
+            if len(href_parts) != 3 or not href_parts[2].endswith('.html'):
+                continue
+
+            reda_code, lang, number = href_parts
+            img_url = ext.url_join(MAGICCARDS_BASE_URL,
+                                   'scans/%s/%s/%s.jpg' % (lang, reda_code, number[:-len('.html')]))
+
+            entries.append(CatalogEntry(ext.normalize_name(card_a.text), ext.uni(card_a.text),
+                                        ext.url_join(MAGICCARDS_BASE_URL, card_a['href']), img_url,
+                                        ext.uni(card_tds[4].text)))
+
+        return entries
+    finally:
+        soup.decompose()
+
+
+def extract_magiccards_redas(page):
+    """Parses magiccards sitemap, english redactions are linked in second table
+
+    :param page: page html
+    :return: list of tuples (redaction name, redaction url)
+    """
+    soup = parse_html(page)
+    try:
+        return [(ext.uni(reda_a.text), ext.url_join(MAGICCARDS_BASE_URL, reda_a['href']))
+                for reda_a in soup.find_all('table')[1].find_all('a')]
+    finally:
+        soup.decompose()
+
+
+def extract_spellshop_redas(page):
+    """Parses spellshop redactions menu
+
+    :param page: page html
+    :return: list of tuples (redaction name, redaction url)
+    """
+    soup = parse_html(page)
+    try:
+        menu_list = soup.find_all('td', class_='menu_body')[1]
+        redactions_container = menu_list.find('table').contents[1].contents[0]
+
+        redas = []
+        for rdiv in redactions_container.find_all('div')[3:37]:
+            reda_tag = rdiv.find('a')
+            redas.append((ext.uni(reda_tag.text), ext.url_join(ext.get_domain(SPELLSHOP_BASE_URL), reda_tag['href'])))
+
+        return redas
+    finally:
+        soup.decompose()
+
+
+def extract_buymagic_redas(page):
+    """Parses buymagic redactions menu
+
+    :param page: page html
+    :return: list of tuples (redaction name, redaction url)
+    """
+    soup = parse_html(clean_buymagic_page(page), from_encoding='utf-8')
+    try:
+        root_div = soup.find_all('div', class_='c1')[1]
+        return [(ext.uni(reda_tag.text), reda_tag['href'])
+                for reda_ul in root_div.find_all('ul')[1:] for reda_tag in reda_ul.find_all('a')]
+    finally:
+        soup.decompose()
+
+
+def extract_tcg_prices(tcg_response, sid):
+    """Parses summary price info of TCGPlayer partner script
+
+    :param tcg_response: script returned by TCGPlayer
+    :param sid: card sid
+    :return: dictionary {sid, tcg card url, low, mid, high}
+    """
+    html_response = tcg_response.replace('\'+\'', '').replace('\\\'', '"')[16:][:-3]
+    tcg_soup = parse_html(html_response)
+    try:
+        return {'sid': ext.uni(sid),
+                'url': ext.get_domain_with_path(tcg_soup.find('td', class_='TCGPHiLoLink').contents[0]['href']),
+                'low': ext.price_to_float(ext.uni(tcg_soup.find('td', class_='TCGPHiLoLow').contents[1].contents[0])),
+                'mid': ext.price_to_float(ext.uni(tcg_soup.find('td', class_='TCGPHiLoMid').contents[1].contents[0])),
+                'high': ext.price_to_float(ext.uni(tcg_soup.find('td', class_='TCGPHiLoHigh').contents[1].contents[0]))}
+    finally:
+        tcg_soup.decompose()
+
+
+def extract_spellshop_rows(page, uah_rate=None):
+    """Parses spellshop redaction listing
+
+    :param page: page html
+    :param uah_rate: uah for one dollar, ext.UAH_RATE if None
+    :return: list of ShopRow
+    """
+    soup = parse_html(page)
+    try:
+        cards_table = soup.find('td', class_='td_center')
+        if cards_table is None:
+            return []
+
+        rows = []
+        for card_div in cards_table.find_all('div'):
+            if not ext.uni(card_div.text):
+                continue
+
+            card_tds = card_div.find('tr').find_all('td')
+            uah_price = ext.uah_to_float(card_tds[4].text)
+            rows.append(ShopRow(ext.uni(card_tds[1].find('a').text),
+                                ext.url_join(ext.get_domain(SPELLSHOP_BASE_URL), card_tds[1].find('a')['href']),
+                                ext.price_to_float(ext.uah_to_dollar(uah_price, uah_rate)),
+                                len(card_tds[5].find_all('option')), uah_price))
+
+        return rows
+    finally:
+        soup.decompose()
+
+
+def clean_buymagic_page(page):
+    """
+    Fixes buymagic markup errors that break parsing
+    """
+    return page \
+        .replace('"bordercolor="#000000" bgcolor="#FFFFFF"', '') \
+        .replace('<link rel="stylesheet" href="/jquery.fancybox-1.3.0.css" type="text/css" media="screen">', '') \
+        .replace('"title=', '" title=')
+
+
+def extract_buymagic_page(page, with_pages=False, uah_rate=None):
+    """Parses buymagic redaction listing page
+
+    :param page: page html
+    :param with_pages: if True urls of pager links are extracted
+    :param uah_rate: uah for one dollar, ext.UAH_RATE if None
+    :return: tuple (list of pager urls, list of ShopRow)
+    """
+    soup = parse_html(clean_buymagic_page(page), from_encoding='utf-8')
+    try:
+        root_div = soup.find('div', class_='c2')
+        pages = []
+        if with_pages:
+            pages = [ext.url_join(ext.get_domain(BUYMAGIC_BASE_URL), tag['href'])
+                     for tag in root_div.contents[5].find_all('a')]
+
+        rows = []
+        card_divs = filter(lambda r: isinstance(r, Tag), list(root_div.find('p').children))[:-1]
+        for card_div in card_divs:
+            inner_div = card_div.find('div')
+            if inner_div is not None:
+                card_div = inner_div
+
+            header_tag = card_div.find('a')
+            price_row = card_div.find('table').find('tr').find_all('td')
+            uah_price = ext.uah_to_float(ext.uni(price_row[1].text))
+            rows.append(ShopRow(ext.uni(header_tag.text),
+                                ext.uni(header_tag['href']),
+                                ext.price_to_float(ext.uah_to_dollar(uah_price, uah_rate)),
+                                len(price_row[2].find_all('option')), uah_price))
+
+        return pages, rows
+    finally:
+        soup.decompose()
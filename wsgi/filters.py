@@ -11,11 +11,12 @@ def active_if(var, value, class_alone=True):
     return ''
 
 
-def url_for_page(page):
+def url_for_page(page, **params):
     """
-    Creates url for specific page
+    Creates url for specific page, params with values are added to query string
     """
     args = request.view_args.copy()
+    args.update((k, v) for k, v in params.items() if v)
     args['page'] = page
     return url_for(request.endpoint, **args)
 
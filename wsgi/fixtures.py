@@ -0,0 +1,146 @@
+import json
+import hashlib
+import urllib
+import zipfile
+import eventlet
+from eventlet import wsgi
+
+
+class FixtureArchive(object):
+    """
+    Zip archive of recorded responses, index.json maps url to status, headers and body file
+    """
+
+    def __init__(self, meta=None):
+        self.meta = meta if meta is not None else {}
+        self.responses = {}
+
+    def add(self, url, status, headers, body):
+        """Adds response to archive, response of the same url is replaced
+
+        :param url: requested url
+        :param status: http status code
+        :param headers: dict of response headers
+        :param body: response body string
+        """
+        self.responses[url] = {'status': status, 'headers': headers, 'body': body}
+
+    def get(self, url):
+        """Returns recorded response of url
+
+        :param url: requested url
+        :return: dict {status, headers, body} or None if url wasn't recorded
+        """
+        return self.responses.get(url)
+
+    def save(self, path):
+        """Writes archive to zip file, bodies are stored by url hash and indexed in index.json
+
+        :param path: path to zip file
+        """
+        index = {}
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for url, response in self.responses.items():
+                body_name = 'bodies/' + hashlib.sha1(url).hexdigest()
+                archive.writestr(body_name, response['body'])
+                index[url] = {'status': response['status'], 'headers': response['headers'], 'body': body_name}
+            archive.writestr('index.json', json.dumps({'meta': self.meta, 'responses': index}))
+
+    @staticmethod
+    def load(path):
+        """Loads archive saved by FixtureArchive.save
+
+        :param path: path to zip file
+        :return: fixtures.FixtureArchive
+        """
+        with zipfile.ZipFile(path, 'r') as archive:
+            index = json.loads(archive.read('index.json'))
+            fixtures = FixtureArchive(index['meta'])
+            for url, response in index['responses'].items():
+                fixtures.add(url.encode('utf-8'), response['status'], response['headers'],
+                             archive.read(response['body']))
+
+        return fixtures
+
+
+class RecordingTransport(object):
+    """
+    Wraps transport and records every fetched response into archive
+    """
+
+    def __init__(self, transport, archive):
+        self.transport = transport
+        self.archive = archive
+
+    def fetch(self, url, headers=None):
+        """
+        Fetches url by wrapped transport and records the response
+        """
+        response = self.transport.fetch(url, headers)
+        self.archive.add(url, response.status, {}, response.body)
+        return response
+
+    @property
+    def stats(self):
+        """
+        Returns fetch stats of wrapped transport
+        """
+        return self.transport.stats
+
+
+class ReplayServer(object):
+    """
+    Local stand-in HTTP server that answers with archived responses after injected latency,
+    requested url is restored from Host header and raw request path
+    """
+
+    def __init__(self, archive, latency=0.):
+        self.archive = archive
+        self.latency = latency
+        self.missed = []
+        self._socket = None
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        Returns (host, port) the server listens on
+        """
+        return self._socket.getsockname()
+
+    def start(self):
+        """Starts serving in green thread on free local port
+
+        :return: self
+        """
+        self._socket = eventlet.listen(('127.0.0.1', 0))
+        self._thread = eventlet.spawn(wsgi.server, self._socket, self._handle, log_output=False)
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes listening socket
+        """
+        self._thread.kill()
+        self._socket.close()
+
+    def _handle(self, environ, start_response):
+        """
+        Answers wsgi request with archived response, url that isn't archived is answered with 404 and remembered
+        """
+        path = environ.get('RAW_PATH_INFO') or urllib.quote(environ['PATH_INFO'])
+        url = 'http://' + environ['HTTP_HOST'] + path
+        if environ.get('QUERY_STRING'):
+            url += '?' + environ['QUERY_STRING']
+
+        if self.latency:
+            eventlet.sleep(self.latency)
+
+        response = self.archive.get(url)
+        if response is None:
+            self.missed.append(url)
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['not recorded: ' + url]
+
+        start_response('%s OK' % response['status'], [('Content-Length', str(len(response['body'])))])
+        return [response['body']]
@@ -0,0 +1,89 @@
+# coding=utf-8
+import re
+from collections import defaultdict
+import ext
+
+# cyrillic letters that look like latin ones, shops mix them in card names
+CYRILLIC_TO_LATIN = dict(zip(u'абвгдеёзиійклмнопрстуфхцчшщъыьэюяєї',
+                             [u'a', u'b', u'v', u'g', u'd', u'e', u'e', u'z', u'i', u'i', u'j', u'k', u'l', u'm',
+                              u'n', u'o', u'p', u'r', u's', u't', u'u', u'f', u'h', u'c', u'ch', u'sh', u'sch',
+                              u'', u'y', u'', u'e', u'yu', u'ya', u'e', u'i']))
+# lookalikes are folded to latin letter they look like, not to transliteration
+CYRILLIC_TO_LATIN.update({u'в': u'b', u'н': u'h', u'с': u'c', u'у': u'y', u'х': u'x', u'р': u'p'})
+NOT_WORD_RE = re.compile(r'[^a-z0-9 ]+')
+
+
+def fold(name):
+    """Normalizes name for fuzzy matching: lowers it, folds cyrillic letters to latin,
+    drops apostrophes and replaces other punctuation with spaces
+
+    :param name: card name
+    :return: folded unicode string
+    """
+    name = u''.join(CYRILLIC_TO_LATIN.get(char, char) for char in ext.normalize_name(name)).replace(u"'", u'')
+    return u' '.join(NOT_WORD_RE.sub(u' ', name).split())
+
+
+def trigrams(folded):
+    """
+    Returns set of trigrams of folded name padded with spaces
+    """
+    padded = u'  %s ' % folded
+    return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+class NameIndex(object):
+    """
+    Inverted trigram index of names, candidates are ranked by Dice similarity of trigram sets
+    """
+
+    def __init__(self, names=()):
+        self._names = []
+        self._grams = []
+        self._postings = defaultdict(list)
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """
+        Indexes name by its trigrams
+        """
+        grams = trigrams(fold(name))
+        index = len(self._names)
+        self._names.append(name)
+        self._grams.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(index)
+
+    def search(self, query, limit=5, min_score=0.):
+        """Ranks indexed names by similarity to query
+
+        :param query: searched name
+        :param limit: max number of candidates
+        :param min_score: candidates with lower score are skipped
+        :return: list of tuples (name, score from 0 to 1), best first
+        """
+        grams = trigrams(fold(query))
+        common = defaultdict(int)
+        for gram in grams:
+            for index in self._postings.get(gram, ()):
+                common[index] += 1
+
+        scored = []
+        for index, count in common.items():
+            score = 2. * count / (len(grams) + self._grams[index])
+            if score >= min_score:
+                scored.append((self._names[index], score))
+
+        scored.sort(key=lambda candidate: candidate[1], reverse=True)
+        return scored[:limit]
+
+    def best(self, query, min_score=0.):
+        """
+        Returns best matched name or None
+        """
+        candidates = self.search(query, limit=1, min_score=min_score)
+        return candidates[0][0] if candidates else None
+
+    def __len__(self):
+        return len(self._names)
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+
+DATA_DIR = os.environ.get('OPENSHIFT_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+CACHE_DIR = os.environ.get('PRICES_HTTP_CACHE_DIR', os.path.join(DATA_DIR, 'http'))
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+# (url pattern, seconds while response is used without revalidation), first matched pattern wins,
+# ttl 0 means that response is always revalidated, urls without pattern are not cached
+TTL_POLICIES = [
+    (r'^http://magiccards\.info/sitemap\.html$', 7 * DAY),
+    (r'^http://magiccards\.info/', 7 * DAY),
+    (r'^http://partner\.tcgplayer\.com/', 12 * HOUR),
+    (r'^http://spellshop\.com\.ua/index\.php\?categoryID=90$', DAY),
+    (r'^http://www\.buymagic\.com\.ua/$', DAY),
+    (r'^http://spellshop\.com\.ua/', 0),
+    (r'^http://www\.buymagic\.com\.ua/', 0),
+]
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of fetched pages. Url entries keep validators and point to
+    zlib compressed bodies stored by content hash, so equal bodies are stored once
+    """
+
+    def __init__(self, root=CACHE_DIR, policies=None):
+        self.root = root
+        policies = TTL_POLICIES if policies is None else policies
+        self.policies = [(re.compile(pattern), ttl) for pattern, ttl in policies]
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'uncached': 0}
+
+    def fetch(self, transport, url, headers):
+        """Returns page body from cache or fetches it by transport,
+        expired entries are revalidated with If-None-Match/If-Modified-Since
+
+        :param transport: transport.Transport
+        :param url: ascii url
+        :param headers: dict of request headers
+        :return: page body
+        """
+        return self.fetch_with_time(transport, url, headers)[0]
+
+    def fetch_with_time(self, transport, url, headers, max_age=None):
+        """Same as fetch, but also tells when returned body was fetched or last revalidated,
+        so data parsed from cached body can be stamped with its real age
+
+        :param max_age: seconds, cached body older than this is revalidated even if url policy allows longer
+        :return: tuple (page body, unix time of fetch)
+        """
+        ttl = self.get_ttl(url)
+        if ttl is None:
+            self.stats['uncached'] += 1
+            return transport.fetch(url, headers).body, time.time()
+        if max_age is not None:
+            ttl = min(ttl, max_age)
+
+        entry = self._load_entry(url)
+        body = self._load_body(entry['body']) if entry is not None else None
+        if body is not None and entry['fetched'] + ttl > time.time():
+            self.stats['hits'] += 1
+            return body, entry['fetched']
+
+        request_headers = dict(headers)
+        if body is not None:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        response = transport.fetch(url, request_headers)
+        if response.status == 304 and body is not None:
+            self.stats['revalidated'] += 1
+            entry['fetched'] = time.time()
+            self._save_entry(url, entry)
+            return body, entry['fetched']
+
+        self.stats['misses'] += 1
+        fetched = time.time()
+        self._save_entry(url, {'url': url,
+                               'etag': response.headers.get('etag'),
+                               'last_modified': response.headers.get('last-modified'),
+                               'fetched': fetched,
+                               'body': self._save_body(response.body)})
+        return response.body, fetched
+
+    def collect_garbage(self, min_age=HOUR):
+        """Deletes stored bodies that no url entry points to anymore, e.g. previous
+        versions of always revalidated listing pages. Bodies younger than min_age
+        are kept, since their entry can be still being written
+
+        :param min_age: seconds
+        :return: number of deleted bodies
+        """
+        referenced = set()
+        urls_dir = os.path.join(self.root, 'urls')
+        for name in os.listdir(urls_dir) if os.path.isdir(urls_dir) else []:
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(urls_dir, name), 'rb') as entry_file:
+                        referenced.add(json.load(entry_file)['body'])
+                except (IOError, ValueError, KeyError):
+                    pass
+
+        deleted = 0
+        threshold = time.time() - min_age
+        for directory, dirs, names in os.walk(os.path.join(self.root, 'bodies')):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.endswith('.z') and name[:-len('.z')] not in referenced and os.path.getmtime(path) < threshold:
+                    os.remove(path)
+                    deleted += 1
+
+        return deleted
+
+    def get_ttl(self, url):
+        """Returns ttl of url by first matched policy
+
+        :return: seconds or None if url isn't cached
+        """
+        for pattern, ttl in self.policies:
+            if pattern.match(url):
+                return ttl
+
+        return None
+
+    def _entry_path(self, url):
+        return os.path.join(self.root, 'urls', hashlib.sha1(url).hexdigest() + '.json')
+
+    def _body_path(self, digest):
+        return os.path.join(self.root, 'bodies', digest[:2], digest + '.z')
+
+    def _load_entry(self, url):
+        try:
+            with open(self._entry_path(url), 'rb') as entry_file:
+                return json.load(entry_file)
+        except (IOError, ValueError):
+            return None
+
+    def _save_entry(self, url, entry):
+        _write_atomic(self._entry_path(url), json.dumps(entry))
+
+    def _load_body(self, digest):
+        try:
+            with open(self._body_path(digest), 'rb') as body_file:
+                return zlib.decompress(body_file.read())
+        except (IOError, zlib.error):
+            return None
+
+    def _save_body(self, body):
+        """Stores compressed body if it isn't stored yet
+
+        :return: content hash of body
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        path = self._body_path(digest)
+        if not os.path.exists(path):
+            _write_atomic(path, zlib.compress(body, 6))
+
+        return digest
+
+
+def _write_atomic(path, data):
+    """
+    Writes file through temporary file, so readers never see partial content
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+    os.rename(tmp_path, path)
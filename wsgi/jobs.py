@@ -0,0 +1,146 @@
+import os
+import socket
+import traceback
+import datetime
+import eventlet
+import db
+import scrapers
+import checkpoints
+
+POLL_INTERVAL = float(os.environ.get('PRICES_JOBS_POLL_INTERVAL', 5))
+# running job which worker didn't report progress for this number of seconds is queued again
+STALE_TIMEOUT = int(os.environ.get('PRICES_JOBS_STALE_TIMEOUT', 15 * 60))
+
+
+def submit(kind, shop=None, reda='all'):
+    """Queues cards update of shop redaction, redactions list update or overpay recomputation,
+    duplicate of queued or running job is merged into it
+
+    :param kind: 'cards', 'redas' or 'overpay'
+    :param shop: shop name or None for all shops
+    :param reda: redaction name or 'all'
+    :return: job dict
+    """
+    return db.enqueue_job(kind, shop, reda)
+
+
+def status(job):
+    """Returns job state that can be serialized to json, ETA is estimated
+    by time spent on already updated redactions
+
+    :param job: job dict
+    :return: dict
+    """
+    progress = job.get('progress') or {}
+    eta = None
+    if job['state'] == 'running' and progress.get('redas_done'):
+        elapsed = (datetime.datetime.utcnow() - job['started']).total_seconds()
+        eta = elapsed / progress['redas_done'] * (progress['redas_total'] - progress['redas_done'])
+
+    return {'id': str(job['_id']), 'kind': job['kind'], 'shop': job['shop'], 'reda': job['reda'],
+            'state': job['state'], 'requests': job.get('requests', 1), 'progress': progress, 'eta': eta,
+            'error': job.get('error'), 'errors': job.get('errors', []),
+            'created': job['created'].isoformat(),
+            'started': job['started'].isoformat() if job.get('started') else None,
+            'finished': job['finished'].isoformat() if job.get('finished') else None}
+
+
+class Progress(object):
+    """
+    Counts job progress and saves it to db, fetches are counted by scrapers transport
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.counts = {'redas_total': 0, 'redas_done': 0, 'cards': 0, 'fetches': 0, 'errors': 0, 'failed_rows': 0,
+                       'new': 0, 'changed': 0, 'unchanged': 0, 'delisted': 0}
+        self._fetches = _get_fetches()
+
+    def add(self, checkpoint=None, **counts):
+        """Adds counts to job progress and saves it with current fetches number
+
+        :param checkpoint: checkpoints.Checkpoint which failed rows are reported, if given
+        :param counts: numbers added to progress counters, e.g. redas_done=1
+        """
+        for name, count in counts.items():
+            self.counts[name] += count
+        self.counts['fetches'] = _get_fetches() - self._fetches
+        if checkpoint is not None:
+            self.counts['failed_rows'] = checkpoint.failed_rows
+
+        db.update_job_progress(self.job_id, dict(self.counts))
+
+
+def run_job(job, shops):
+    """Runs job in current process, failed redaction is counted as error
+    and doesn't stop the job. Job progress is checkpointed by job id,
+    so requeued job resumes from finished redactions and listing pages
+
+    :param job: job dict
+    :param shops: list of scraper classes
+    """
+    progress = Progress(job['_id'])
+
+    if job['kind'] == 'redas':
+        progress.add(redas_total=1)
+        db.save_redas(scrapers.get_redactions())
+        progress.add(redas_done=1)
+        return
+
+    if job['kind'] == 'overpay':
+        progress.add(redas_total=1)
+        stats = db.recompute_overpay()
+        progress.add(redas_done=1, cards=stats['cards'], changed=stats['modified'])
+        return
+
+    shops = [sh for sh in shops if job['shop'] is None or sh.SHOP_NAME == job['shop']]
+    redas = db.get_redas() if job['reda'] == 'all' else db.get_redas(name=job['reda'])
+    redas = [r for r in redas if any(sh.SHOP_NAME in r.shops for sh in shops)]
+    checkpoint = checkpoints.Checkpoint(job['_id'])
+    progress.add(checkpoint, redas_total=len(redas))
+
+    for reda in redas:
+        fetches = _get_fetches()
+        try:
+            reports = scrapers.save_shops_cards([sh for sh in shops if sh.SHOP_NAME in reda.shops], reda, checkpoint)
+        except Exception:
+            db.add_job_error(job['_id'], reda.name, traceback.format_exc())
+            progress.add(checkpoint, redas_done=1, errors=1)
+        else:
+            # fetches of concurrently scraped shops can't be told apart, they are shared evenly,
+            # shops skipped by checkpoint aren't reported, so their freshness is left as it was
+            fetches = float(_get_fetches() - fetches) / max(len(reports), 1)
+            for shop_name, report in reports.items():
+                db.save_freshness(shop_name, reda.name, report, fetches)
+            counts = dict((key, sum(report[key] for report in reports.values()))
+                          for key in ('new', 'changed', 'unchanged', 'delisted'))
+            progress.add(checkpoint, redas_done=1, cards=counts['new'] + counts['changed'] + counts['unchanged'],
+                         **counts)
+
+
+def work(shops, drain=False):
+    """Runs queued jobs one by one, jobs of crashed workers are queued again before each claim
+
+    :param shops: list of scraper classes
+    :param drain: if True returns when queue is empty, otherwise polls queue forever
+    """
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    while True:
+        db.requeue_stale_jobs(STALE_TIMEOUT)
+        job = db.claim_job(worker)
+        if job is None:
+            if drain:
+                return
+            eventlet.sleep(POLL_INTERVAL)
+            continue
+
+        try:
+            run_job(job, shops)
+        except Exception:
+            db.finish_job(job['_id'], error=traceback.format_exc())
+        else:
+            db.finish_job(job['_id'])
+
+
+def _get_fetches():
+    return sum(host['fetches'] for host in scrapers.http.stats.values())
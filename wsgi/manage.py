@@ -0,0 +1,220 @@
+import json
+import argparse
+import db
+import run
+import bench
+import scrapers
+import jobs
+import parsing
+import refresh
+
+
+def ensure_indexes(args):
+    """
+    Creates db indexes and optionally checks that queries use them
+    """
+    shops = [sh.SHOP_NAME for sh in run.all_shops]
+
+    db.ensure_indexes(shops)
+    if args.check:
+        db.check_query_plans(shops)
+
+
+def check_plans(args):
+    """
+    Checks that db queries are covered by indexes
+    """
+    db.check_query_plans([sh.SHOP_NAME for sh in run.all_shops])
+
+
+def reconcile_counters(args):
+    """
+    Recounts shop cards counters from scratch
+    """
+    db.reconcile_counters([sh.SHOP_NAME for sh in run.all_shops])
+
+
+def record(args):
+    """
+    Records redaction scrape responses into fixture archive
+    """
+    shop_scraper = _get_shop(args.shop)
+    reda = [r for r in db.get_redas(name=args.reda) if shop_scraper.SHOP_NAME in r.shops][0]
+    print bench.record(shop_scraper, reda, args.out, cold=not args.warm)
+
+
+def benchmark(args):
+    """
+    Replays fixture archives and prints measurements of each scrape
+    """
+    for path in args.archives:
+        result = bench.run(run.all_shops, path, latency=args.latency, save=args.save, throttled=not args.unthrottled)
+        if args.json:
+            print json.dumps(result)
+        else:
+            print '%(shop)s/%(redaction)s: cards %(cards)d, wall %(wall).2fs, fetches %(fetches)d, ' \
+                  'parse %(parse).2fs, db %(db).2fs, missed %(missed)d' % result
+
+
+def benchmark_parse(args):
+    """
+    Measures CPU time of magiccards pages extraction against bare parse and whole tree walks
+    """
+    for path in args.archives:
+        print '%(path)s: pages %(pages)d, parse %(parse).2fs, extraction %(extracted).2fs, ' \
+              'tree walks %(walked).2fs' % dict(bench.parse(path, args.repeat), path=path)
+
+
+def purge_failures(args):
+    """
+    Removes remembered card search failures
+    """
+    print 'purged %d failures' % db.purge_card_failures(args.reda or None, args.reason)
+
+
+def build_catalog(args):
+    """
+    Parses magiccards set listings into local cards catalog
+    """
+    redas = [r for r in db.get_redas() if not args.reda or r.name in args.reda]
+    result = scrapers.build_catalog(redas)
+    print 'saved %d catalog entries' % result['saved']
+    for reda, error in sorted(result['failed'].items()):
+        print '%s: failed, %s' % (reda, error)
+
+
+def refresh_prices(args):
+    """
+    Refreshes stale tcgplayer prices within fetch budget
+    """
+    print 'fetched %(fetched)d sids, failed %(failed)d, updated %(updated)d cards' % \
+        scrapers.refresh_prices(args.max_age * 60 * 60, args.budget)
+
+
+def recompute_overpay(args):
+    """
+    Recomputes overpay of stored shop offers, uah rate is stored first if it's given
+    """
+    if args.uah_rate:
+        db.set_uah_rate(args.uah_rate)
+    print 'recomputed %(cards)d cards, modified %(modified)d' % db.recompute_overpay()
+
+
+def work(args):
+    """
+    Runs queued update jobs
+    """
+    jobs.work(run.all_shops, drain=args.drain)
+
+
+def requeue_job(args):
+    """
+    Queues finished job again, it skips work recorded in its checkpoint
+    """
+    print 'requeued' if db.requeue_job(args.job_id) else 'job is unknown or not finished'
+
+
+def refresh_planned(args):
+    """
+    Refreshes prices and queues listing updates that fit into fetch budget
+    """
+    if args.dry_run:
+        planned = refresh.plan(run.all_shops, args.budget)
+    else:
+        result = refresh.run(run.all_shops, args.budget)
+        print 'prices: fetched %(fetched)d sids, failed %(failed)d, updated %(updated)d cards' % result['prices']
+        planned = result['listings']
+
+    for shop, reda, urgency, cost in planned:
+        print '%s %s: score %.1f, cost %d' % (shop, reda, urgency, cost)
+
+
+def gc_http_cache(args):
+    """
+    Deletes cached response bodies that are not referenced anymore
+    """
+    print 'deleted %d bodies' % scrapers.responses_cache.collect_garbage(args.min_age * 60 * 60)
+
+
+def _get_shop(name):
+    return [sh for sh in run.all_shops if sh.SHOP_NAME == name][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='prices app maintenance commands')
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser('ensure-indexes', help='create db indexes')
+    command.add_argument('--check', action='store_true', help='check query plans after creation')
+    command.set_defaults(func=ensure_indexes)
+
+    command = commands.add_parser('check-plans', help='fail if any db query uses collection scan or in-memory sort')
+    command.set_defaults(func=check_plans)
+
+    command = commands.add_parser('reconcile-counters', help='recount shop cards counters from scratch')
+    command.set_defaults(func=reconcile_counters)
+
+    command = commands.add_parser('record', help='record redaction scrape into fixture archive')
+    command.add_argument('shop')
+    command.add_argument('reda')
+    command.add_argument('--out', help='archive path')
+    command.add_argument('--warm', action='store_true', help='use cards stored in db instead of resolving all cards')
+    command.set_defaults(func=record)
+
+    command = commands.add_parser('bench', help='replay fixture archives offline and measure scrapes')
+    command.add_argument('archives', nargs='+')
+    command.add_argument('--latency', type=float, default=0., help='seconds injected before every response')
+    command.add_argument('--save', action='store_true', help='save scraped cards to db')
+    command.add_argument('--unthrottled', action='store_true', help='lift per-host fetch limits')
+    command.add_argument('--json', action='store_true', help='print results as json lines')
+    command.set_defaults(func=benchmark)
+
+    command = commands.add_parser('bench-parse', help='measure CPU time of magiccards pages extraction')
+    command.add_argument('archives', nargs='+')
+    command.add_argument('--repeat', type=int, default=10, help='number of times every page is parsed')
+    command.set_defaults(func=benchmark_parse)
+
+    command = commands.add_parser('purge-failures', help='forget cards that magiccards could not resolve')
+    command.add_argument('--reda', action='append', help='redaction name, may be repeated')
+    command.add_argument('--reason', help="failure reason, e.g. 'no hint'")
+    command.set_defaults(func=purge_failures)
+
+    command = commands.add_parser('build-catalog', help='parse magiccards set listings into local cards catalog')
+    command.add_argument('--reda', action='append', help='redaction name, may be repeated')
+    command.set_defaults(func=build_catalog)
+
+    command = commands.add_parser('refresh-prices', help='refetch tcgplayer prices older than max age')
+    command.add_argument('--max-age', type=float, default=24, help='prices age in hours')
+    command.add_argument('--budget', type=int, default=500, help='max number of tcgplayer fetches')
+    command.set_defaults(func=refresh_prices)
+
+    command = commands.add_parser('recompute-overpay', help='recompute overpay of stored offers without scraping')
+    command.add_argument('--uah-rate', type=float, help='uah for one dollar, stored rate is used if omitted')
+    command.set_defaults(func=recompute_overpay)
+
+    command = commands.add_parser('work', help='run queued update jobs')
+    command.add_argument('--drain', action='store_true', help='exit when job queue is empty')
+    command.set_defaults(func=work)
+
+    command = commands.add_parser('requeue-job', help='resume finished or failed job from its checkpoint')
+    command.add_argument('job_id')
+    command.set_defaults(func=requeue_job)
+
+    command = commands.add_parser('refresh', help='refresh most urgent prices and listings within fetch budget')
+    command.add_argument('--budget', type=int, default=refresh.REFRESH_BUDGET, help='max number of fetches')
+    command.add_argument('--dry-run', action='store_true', help='only print planned listings')
+    command.set_defaults(func=refresh_planned)
+
+    command = commands.add_parser('gc-http-cache', help='delete cached bodies no url points to')
+    command.add_argument('--min-age', type=float, default=1, help='keep bodies younger than this number of hours')
+    command.set_defaults(func=gc_http_cache)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    finally:
+        parsing.close()
+
+
+if __name__ == '__main__':
+    main()
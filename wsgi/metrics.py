@@ -0,0 +1,34 @@
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+
+timings = defaultdict(float)
+counts = defaultdict(int)
+
+
+@contextmanager
+def timed(name):
+    """
+    Accumulates duration and number of calls of wrapped block under name
+    """
+    started = time.time()
+    try:
+        yield
+    finally:
+        timings[name] += time.time() - started
+        counts[name] += 1
+
+
+def reset():
+    """
+    Clears all timings and counts
+    """
+    timings.clear()
+    counts.clear()
+
+
+def snapshot():
+    """
+    Returns dict {name: {seconds, calls}}
+    """
+    return dict((name, {'seconds': timings[name], 'calls': counts[name]}) for name in timings)
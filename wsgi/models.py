@@ -1,4 +1,5 @@
 from math import ceil
+import ext
 
 
 class Card(object):
@@ -14,6 +15,30 @@ class Card(object):
         self.info = info
         self.shops = shops if shops else {}
 
+    def refresh_overpay(self, uah_rate=None):
+        """Recomputes overpay of every shop offer by current prices
+
+        :param uah_rate: if given dollar price of offers with known uah price is recomputed by this rate
+        :return: True if any offer price or overpay changed
+        """
+        changed = False
+        for shop in self.shops.values():
+            price = shop.price
+            if uah_rate and shop.uah_price is not None:
+                price = ext.price_to_float(ext.uah_to_dollar(shop.uah_price, uah_rate))
+            overpay = self.prices.avg / price
+            if (price, overpay) != (shop.price, shop.overpay):
+                shop.price, shop.overpay = price, overpay
+                changed = True
+
+        return changed
+
+    def copy(self):
+        """
+        Returns card copy with its own shops dict
+        """
+        return Card(self.name, self.redaction, self.type, self.info, self.prices, dict(self.shops))
+
     def __hash__(self):
         return hash((self.name, self.redaction))
 
@@ -39,15 +64,16 @@ class CardInfo(object):
 
 class CardPrices(object):
     """
-    Card info from TCGPlayer
+    Card info from TCGPlayer, updated is utc time when prices were fetched
     """
 
-    def __init__(self, sid, url, low, mid, high):
+    def __init__(self, sid, url, low, mid, high, updated=None):
         self.sid = sid
         self.url = url
         self.low = low
         self.mid = mid
         self.high = high
+        self.updated = updated
 
     @property
     def avg(self):
@@ -59,16 +85,19 @@ class CardPrices(object):
 
 class Shop(object):
     """
-    Represents shop offer for some card
+    Represents shop offer for some card, price is in dollars and uah_price is price as shop shows it,
+    fingerprint identifies listing row the offer was built from
     """
 
-    def __init__(self, name, url, price, overpay, number, type='common'):
+    def __init__(self, name, url, price, overpay, number, type='common', uah_price=None, fingerprint=None):
         self.name = name
         self.url = url
         self.price = price
         self.overpay = overpay
         self.number = number
         self.type = type
+        self.uah_price = uah_price
+        self.fingerprint = fingerprint
 
     def __hash__(self):
         return hash((self.name, self.url))
@@ -103,12 +132,15 @@ class Redaction(object):
 
 class Pagination(object):
     """
-    Represents pagination logic
+    Represents pagination logic, neighbour pages can be reached by
+    continuation tokens of first and last items of current page
     """
-    def __init__(self, page, per_page, total_count):
+    def __init__(self, page, per_page, total_count, prev_token=None, next_token=None):
         self.page = page
         self.per_page = per_page
         self.total_count = total_count
+        self.prev_token = prev_token
+        self.next_token = next_token
 
     @property
     def pages(self):
@@ -125,7 +157,8 @@ class Pagination(object):
     def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
         last = 0
         for num in xrange(1, self.pages + 1):
-            if num <= left_edge or self.page - left_current - 1 < num < self.page + right_current or num > self.pages - right_edge:
+            if num <= left_edge or self.page - left_current - 1 < num < self.page + right_current \
+                    or num > self.pages - right_edge:
                 if last + 1 != num:
                     yield None
                 yield num
@@ -0,0 +1,53 @@
+import os
+import multiprocessing
+from eventlet import tpool
+import metrics
+
+PARSE_WORKERS = int(os.environ.get('PRICES_PARSE_WORKERS', multiprocessing.cpu_count()))
+
+_pool = None
+_pool_pid = None
+
+
+def get_pool():
+    """Returns pool of parse worker processes, pool is created lazily
+    and recreated after fork
+
+    :return: multiprocessing.Pool
+    """
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        _pool = multiprocessing.Pool(PARSE_WORKERS)
+        _pool_pid = pid
+
+    return _pool
+
+
+def run(func, *args):
+    """Runs parse function in worker process, current green thread waits for result
+    in OS thread of eventlet thread pool, so eventlet hub isn't blocked nor polled.
+    If PARSE_WORKERS is 0 function is run in place
+
+    :param func: module level function that takes page strings and returns plain records
+    :param args: function arguments
+    :return: function result
+    """
+    with metrics.timed('parse'):
+        if PARSE_WORKERS <= 0:
+            return func(*args)
+
+        return tpool.execute(get_pool().apply_async(func, args).get)
+
+
+def close():
+    """
+    Stops parse worker processes of current process, pool is created again on next run
+    """
+    global _pool
+
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+        _pool.join()
+    _pool = None
@@ -0,0 +1,85 @@
+import os
+import math
+import datetime
+import db
+import jobs
+import scrapers
+
+REFRESH_BUDGET = int(os.environ.get('PRICES_REFRESH_BUDGET', 500))
+# share of budget spent on tcgplayer prices of cards, the rest is spent on shop listings
+PRICES_SHARE = float(os.environ.get('PRICES_REFRESH_PRICES_SHARE', .2))
+PRICES_MAX_AGE = int(os.environ.get('PRICES_REFRESH_PRICES_MAX_AGE', 24 * 60 * 60))
+# listing refreshed more recently isn't scheduled
+MIN_INTERVAL = int(os.environ.get('PRICES_REFRESH_MIN_INTERVAL', 60 * 60))
+# age of listing that was never refreshed, also the age above which listing isn't getting more urgent
+MAX_AGE = 30 * 24 * 60 * 60
+# estimated fetches of listing that was never refreshed
+DEFAULT_COST = 20
+VOLATILITY_WEIGHT = 10.
+
+
+def score(state, now):
+    """Scores urgency of listing refresh: age multiplied by volatility and by max overpay weights,
+    so valuable and often changed listings go first, long stale ones next
+    and old static sets only when they are stale enough
+
+    :param state: freshness dict of listing, empty if it was never refreshed
+    :param now: utc datetime
+    :return: float, 0 if listing was refreshed less than MIN_INTERVAL ago
+    """
+    age = (now - state['refreshed']).total_seconds() if state else MAX_AGE
+    if age < MIN_INTERVAL:
+        return 0.
+
+    return min(age, MAX_AGE) / 3600. * \
+        (1 + VOLATILITY_WEIGHT * state.get('volatility', 0.)) * \
+        (1 + math.log1p(state.get('max_overpay', 0.)))
+
+
+def plan(shops, budget):
+    """Picks shop redaction listings to refresh, most urgent first, while their
+    fetch cost estimated by previous refresh fits into budget
+
+    :param shops: list of scraper classes
+    :param budget: number of fetches
+    :return: list of tuples (shop name, redaction name, score, cost)
+    """
+    freshness = db.get_freshness()
+    now = datetime.datetime.utcnow()
+
+    candidates = []
+    for reda in db.get_redas():
+        for shop in shops:
+            if shop.SHOP_NAME not in reda.shops:
+                continue
+
+            state = freshness.get((shop.SHOP_NAME, reda.name), {})
+            urgency = score(state, now)
+            if urgency > 0:
+                candidates.append((shop.SHOP_NAME, reda.name, urgency, max(state.get('cost', DEFAULT_COST), 1)))
+
+    planned = []
+    for candidate in sorted(candidates, key=lambda c: c[2], reverse=True):
+        if candidate[3] <= budget:
+            planned.append(candidate)
+            budget -= candidate[3]
+
+    return planned
+
+
+def run(shops, budget=REFRESH_BUDGET):
+    """Spends PRICES_SHARE of budget on stale tcgplayer prices of most valuable cards
+    and queues update jobs of planned listings for the rest
+
+    :param shops: list of scraper classes
+    :param budget: number of fetches
+    :return: dict {prices: refresh_prices result, listings: planned listings}
+    """
+    prices_budget = int(budget * PRICES_SHARE)
+    prices = scrapers.refresh_prices(PRICES_MAX_AGE, prices_budget)
+
+    planned = plan(shops, budget - prices['fetched'])
+    for shop_name, reda_name, urgency, cost in planned:
+        jobs.submit('cards', shop=shop_name, reda=reda_name)
+
+    return {'prices': prices, 'listings': planned}
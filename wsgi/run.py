@@ -1,8 +1,15 @@
-from flask import Flask, render_template, redirect, url_for
+import os
+import gzip
+import hashlib
+from StringIO import StringIO
+from flask import Flask, Response, render_template, redirect, url_for, request, abort, jsonify
 import models
 import scrapers
 import db
 import filters
+import cache
+import fuzzy
+import jobs
 
 app = Flask(__name__)
 filters.register(app)
@@ -11,43 +18,103 @@ all_shops = [scrapers.SpellShopScraper, scrapers.BuyMagicScraper]
 all_shops_route = '(%s)' % '|'.join(ash.SHOP_NAME for ash in all_shops)
 cards_per_page = 40
 
+pages_cache = cache.LRUCache(max_size=int(os.environ.get('PRICES_CACHE_SIZE', 512)),
+                             ttl=int(os.environ.get('PRICES_CACHE_TTL', 3600)))
+names_cache = cache.LRUCache(max_size=64, ttl=int(os.environ.get('PRICES_CACHE_TTL', 3600)))
+search_max_limit = 50
+
+
+def cached_page(key, render):
+    """Returns response with page cached by key and current data version.
+    Page is rendered and gzipped once on cache miss, ETag is derived from
+    data version and differs for gzipped and plain page, so unchanged pages are answered with 304
+
+    :param key: tuple that identifies page
+    :param render: callable without arguments that renders page on cache miss
+    :return: flask.Response
+    """
+    version = db.get_data_version()
+    gzipped = 'gzip' in request.accept_encodings
+    etag = hashlib.md5('%s:%r' % (version, key)).hexdigest() + ('-gz' if gzipped else '')
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body, gzip_body = pages_cache.get_or_set((version,) + key, lambda: compress(render()))
+        if gzipped:
+            response = Response(gzip_body, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype='text/html')
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress(page):
+    """Encodes rendered page and gzips it
+
+    :param page: unicode string
+    :return: tuple (utf-8 page, gzipped utf-8 page)
+    """
+    body = page.encode('utf-8')
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as gzip_file:
+        gzip_file.write(body)
+
+    return body, buf.getvalue()
+
 
 @app.route('/')
 def index():
     cards_at_page = 18
-    cards_spellshop = db.get_cards(shop=scrapers.SpellShopScraper.SHOP_NAME, limit=cards_at_page)
-    cards_buymagic = db.get_cards(shop=scrapers.BuyMagicScraper.SHOP_NAME, limit=cards_at_page)
-    return render_template('index.html', cards_spellshop=cards_spellshop, cards_buymagic=cards_buymagic)
+
+    def render():
+        cards_spellshop = db.get_cards(shop=scrapers.SpellShopScraper.SHOP_NAME, limit=cards_at_page)
+        cards_buymagic = db.get_cards(shop=scrapers.BuyMagicScraper.SHOP_NAME, limit=cards_at_page)
+        return render_template('index.html', cards_spellshop=cards_spellshop, cards_buymagic=cards_buymagic)
+
+    return cached_page(('index',), render)
 
 
 @app.route('/redactions')
 def redactions():
-    return render_template('redactions.html', redas=sorted(db.get_redas(), key=lambda r: r.name))
+    return cached_page(('redactions',), lambda: render_template(
+        'redactions.html', redas=sorted(db.get_redas(), key=lambda r: r.name)))
 
 
 @app.route('/redactions/update')
 def redactions_update():
-    redas = scrapers.get_redactions()
+    job = jobs.submit('redas')
 
-    db.save_redas(redas)
-
-    return redirect(url_for('redactions'))
+    return redirect(url_for('job_status', job_id=str(job['_id'])))
 
 
 @app.route('/<regex("(' + all_shops_route + ')"):shop>', defaults={'reda': 'all', 'page': 1}, methods=['GET'])
-@app.route('/<regex("(' + all_shops_route + ')"):shop>/<regex("((?!update).*)"):reda>', defaults={'page': 1}, methods=['GET'])
+@app.route('/<regex("(' + all_shops_route + ')"):shop>/<regex("((?!update).*)"):reda>', defaults={'page': 1},
+           methods=['GET'])
 @app.route('/<regex("(' + all_shops_route + ')"):shop>/<regex("((?!update).*)"):reda>/<int:page>', methods=['GET'])
 def shop(shop, reda, page):
     if shop not in [sh.SHOP_NAME for sh in all_shops]:
         shop = all_shops[0].SHOP_NAME
 
-    redas = filter(lambda r: shop in r.shops, db.get_redas())
-    cards = db.get_cards(shop=shop, redas=None if reda == 'all' else [reda],
-                         skip=(page - 1) * cards_per_page, limit=cards_per_page)
-    count = db.get_cards_count(shop=shop, redas=None if reda == 'all' else [reda])
+    after, before = request.args.get('after'), request.args.get('before')
+
+    def render():
+        redas = filter(lambda r: shop in r.shops, db.get_redas())
+        try:
+            cards, prev_token, next_token = db.get_cards_page(shop=shop, redas=None if reda == 'all' else [reda],
+                                                              skip=(page - 1) * cards_per_page, limit=cards_per_page,
+                                                              after=after, before=before)
+        except ValueError:
+            abort(400)
+        count = db.get_cards_count(shop=shop, redas=None if reda == 'all' else [reda])
+
+        return render_template('shop.html', shop=shop, active_reda=reda, redas=redas, cards=cards,
+                               pagination=models.Pagination(page, cards_per_page, count, prev_token, next_token))
 
-    return render_template('shop.html', shop=shop, active_reda=reda, redas=redas, cards=cards,
-                           pagination=models.Pagination(page, cards_per_page, count))
+    return cached_page(('shop', shop, reda, page, after, before), render)
 
 
 @app.route('/<regex("(' + all_shops_route + ')"):shop>/update', defaults={'reda': 'all'}, methods=['GET'])
@@ -56,13 +123,61 @@ def shop_update(shop, reda):
     if shop not in [sh.SHOP_NAME for sh in all_shops]:
         shop = all_shops[0].SHOP_NAME
 
-    redas = filter(lambda r: shop in r.shops, db.get_redas() if reda == 'all' else db.get_redas(name=reda))
+    job = jobs.submit('cards', shop=shop, reda=reda)
+
+    return redirect(url_for('job_status', job_id=str(job['_id'])))
+
+
+@app.route('/update', defaults={'reda': 'all'}, methods=['GET'])
+@app.route('/update/<reda>', methods=['GET'])
+def shops_update(reda):
+    job = jobs.submit('cards', reda=reda)
+
+    return redirect(url_for('job_status', job_id=str(job['_id'])))
+
+
+@app.route('/jobs')
+def jobs_list():
+    return jsonify(jobs=[jobs.status(job) for job in db.get_jobs()])
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = db.get_job(job_id)
+    if job is None:
+        abort(404)
+
+    return jsonify(jobs.status(job))
+
+
+@app.route('/overpay/recompute', methods=['POST'])
+def overpay_recompute():
+    uah_rate = request.values.get('uah_rate', type=float)
+    if uah_rate:
+        db.set_uah_rate(uah_rate)
+    job = jobs.submit('overpay')
+
+    return redirect(url_for('job_status', job_id=str(job['_id'])))
+
+
+@app.route('/search/<reda>')
+def search(reda):
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+
+    index = names_cache.get_or_set((db.get_data_version(), db.get_catalog_version(), reda), lambda: fuzzy.NameIndex(
+        set([name for name, r in db.get_catalog([reda])] + [name for name, r in db.get_known_cards([reda])])))
+    candidates = index.search(request.args.get('q', ''), limit=min(limit, search_max_limit))
+    return jsonify(candidates=[{'name': name, 'score': score} for name, score in candidates])
 
-    for r in redas:
-        cards = [sh for sh in all_shops if sh.SHOP_NAME == shop][0].get_cards(r)
-        db.save_cards(cards)
 
-    return redirect(url_for('shop', shop=shop, reda=reda))
+@app.route('/stats/cache')
+def cache_stats():
+    return jsonify(pages_cache.stats)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+import time
+import eventlet
+from eventlet.event import Event
+
+# per-host limits: concurrency starts at 'start' and adapts within [min, max],
+# requests are paced by token bucket of 'rate' requests per second with 'burst' capacity,
+# responses slower than 'latency' seconds are treated as overload signal
+DEFAULT_POLICY = {'start': 4, 'min': 1, 'max': 16, 'rate': 10., 'burst': 10, 'latency': 3.}
+HOST_POLICIES = {
+    'magiccards.info': {'start': 8, 'min': 1, 'max': 32, 'rate': 20., 'burst': 20, 'latency': 3.},
+    'partner.tcgplayer.com': {'start': 8, 'min': 1, 'max': 32, 'rate': 20., 'burst': 20, 'latency': 3.},
+    'spellshop.com.ua': {'start': 2, 'min': 1, 'max': 4, 'rate': 2., 'burst': 4, 'latency': 5.},
+    'www.buymagic.com.ua': {'start': 2, 'min': 1, 'max': 4, 'rate': 2., 'burst': 4, 'latency': 5.},
+}
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class Scheduler(object):
+    """
+    Limits fetches to every host by adaptive concurrency and token bucket rate
+    """
+
+    def __init__(self, policies=None, default=None):
+        self.policies = HOST_POLICIES if policies is None else policies
+        self.default = DEFAULT_POLICY if default is None else default
+        self._limiters = {}
+
+    def acquire(self, host):
+        """Waits for free slot and token of host
+
+        :param host: host name
+        :return: scheduler.HostLimiter which release must be called after fetch
+        """
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = self._limiters[host] = HostLimiter(**self.policies.get(host, self.default))
+
+        limiter.acquire()
+        return limiter
+
+    @property
+    def stats(self):
+        """
+        Returns dict {host: limiter stats}
+        """
+        return dict((host, limiter.stats) for host, limiter in self._limiters.items())
+
+
+class HostLimiter(object):
+    """
+    Concurrency limit of one host adapted by additive increase/multiplicative decrease:
+    limit grows by one after a limit worth of fast successful fetches
+    and is halved on error, throttling status or slow response
+    """
+
+    def __init__(self, start, min, max, rate, burst, latency):
+        self.limit = start
+        self.min_limit = min
+        self.max_limit = max
+        self.rate = rate
+        self.burst = burst
+        self.target_latency = latency
+        self.active = 0
+        self.fetches = 0
+        self.errors = 0
+        self.avg_latency = 0.
+        self._successes = 0
+        self._tokens = float(burst)
+        self._refilled = time.time()
+        self._waiters = []
+
+    def acquire(self):
+        """
+        Waits for free slot under concurrency limit and for rate token, then takes the slot
+        """
+        while self.active >= self.limit:
+            waiter = Event()
+            self._waiters.append(waiter)
+            waiter.wait()
+
+        self.active += 1
+        self._take_token()
+
+    def release(self, latency, failed=False):
+        """Frees slot and adapts concurrency limit
+
+        :param latency: fetch duration in seconds
+        :param failed: True if fetch raised or server signaled overload
+        """
+        self.active -= 1
+        self.fetches += 1
+        self.avg_latency = latency if self.fetches == 1 else self.avg_latency * .8 + latency * .2
+
+        if failed or latency > self.target_latency:
+            self.errors += failed
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+        else:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+
+        for _ in xrange(min(len(self._waiters), self.limit - self.active)):
+            self._waiters.pop(0).send()
+
+    def _take_token(self):
+        """
+        Waits until token bucket has token and takes it
+        """
+        while True:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            eventlet.sleep((1 - self._tokens) / self.rate)
+
+    @property
+    def stats(self):
+        """
+        Returns dict with concurrency limit, active and waiting fetches, fetch and error counters, average latency
+        """
+        return {'limit': self.limit, 'active': self.active, 'waiting': len(self._waiters),
+                'fetches': self.fetches, 'errors': self.errors, 'avg_latency': self.avg_latency}
@@ -1,14 +1,23 @@
 # coding=utf-8
-import gzip
+import os
+import sys
 import csv
+import hashlib
+import datetime
 import eventlet
-import difflib
-from StringIO import StringIO
+from eventlet.queue import LightQueue
 from eventlet.green import urllib2
-from bs4 import BeautifulSoup, Tag
 import models
 import ext
 import db
+import transport
+import httpcache
+import metrics
+import parsing
+import extractors
+import fuzzy
+import checkpoints
+from singleflight import SingleFlight
 
 
 def get_redactions():
@@ -23,25 +32,428 @@ def get_redactions():
     return redas
 
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/27.0.1453.110 Safari/537.36',
+    'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.6,en;q=0.4',
+    'Accept-Encoding': 'gzip,deflate',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Cache-Control': 'max-age=0'
+}
+
+http = transport.Transport()
+responses_cache = httpcache.ResponseCache()
+
+
+def spawn_map(func, items):
+    """Runs func over items in green threads and yields results in items order.
+    Fan-out isn't limited here, fetches are limited per host by http transport scheduler
+
+    :param func: function of one argument
+    :param items: list of arguments
+    """
+    pool = eventlet.GreenPool(max(len(items), 1))
+    return pool.imap(func, items)
+
+
+# max number of calls that stream_map keeps in flight and max number of results waiting for consumer
+STREAM_SIZE = int(os.environ.get('PRICES_STREAM_SIZE', 50))
+
+
+def stream_map(func, items, size=STREAM_SIZE):
+    """Runs func over items in green threads and yields results as they are ready, not in items order.
+    Items are consumed lazily and calls are spawned only while their results are taken,
+    so memory is bounded by size regardless of number of items.
+    Exception of a call or of items iteration is raised in consumer
+
+    :param func: function of one argument
+    :param items: iterable of arguments
+    :param size: max number of calls in flight and of results waiting for consumer
+    """
+    pool = eventlet.GreenPool(size)
+    results = LightQueue(size)
+    # number of spawned calls which results aren't taken yet, every call puts exactly one result
+    pending = [0]
+
+    def call(item):
+        try:
+            results.put((True, func(item)))
+        except Exception:
+            results.put((False, sys.exc_info()))
+
+    def feed():
+        failure = None
+        try:
+            for item in items:
+                pool.spawn_n(call, item)
+                pending[0] += 1
+        except Exception:
+            failure = sys.exc_info()
+        pool.waitall()
+        # None marks the end of results, it goes with exception of items iteration if any
+        results.put((None, failure))
+
+    feeder = eventlet.spawn(feed)
+    try:
+        while True:
+            ok, result = results.get()
+            if ok is None:
+                if result is not None:
+                    raise result[0], result[1], result[2]
+                return
+
+            pending[0] -= 1
+            if not ok:
+                raise result[0], result[1], result[2]
+            yield result
+    finally:
+        # calls may be blocked on full queue, so results are taken until every spawned call puts its own
+        feeder.kill()
+        while pending[0]:
+            ok, result = results.get()
+            if ok is not None:
+                pending[0] -= 1
+
+
+RETRY_ATTEMPTS = int(os.environ.get('PRICES_RETRY_ATTEMPTS', 3))
+# pause before second attempt in seconds, it is doubled for every next attempt
+RETRY_BACKOFF = float(os.environ.get('PRICES_RETRY_BACKOFF', 1.))
+# max number of listing pages of one shop that are fetched and resolved concurrently
+LISTING_PAGES_IN_FLIGHT = 4
+
+
+def retry(func, *args):
+    """Calls func, failed call is repeated up to RETRY_ATTEMPTS attempts in total
+    with exponential backoff, exception of the last attempt is raised
+
+    :param func: function
+    :param args: function arguments
+    :return: function result
+    """
+    for attempt in xrange(RETRY_ATTEMPTS):
+        try:
+            return func(*args)
+        except Exception:
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            eventlet.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+# min trigram similarity of shop listing name and catalog name to treat them as one card
+FUZZY_MIN_SCORE = .75
+
+
+card_flights = SingleFlight()
+price_flights = SingleFlight()
+
+
+class CardResolver(object):
+    """
+    Resolves shop listing names of one redaction to cards. Prefetched cards, known failures
+    and magiccards catalog are checked before magiccards search, new failures are stored,
+    so they aren't searched again until they expire.
+    Every name is resolved upstream once per resolver, concurrent resolutions of the same name
+    are shared between all resolvers, so shops scraped with one resolver share resolutions.
+    Known cards, failures and catalog are loaded from db unless they are given, resolver created
+    with persist=False keeps new failures and catalog sids in memory only
+    """
+
+    def __init__(self, reda_name, known_cards=None, failures=None, catalog=None, persist=True):
+        self.reda_name = reda_name
+        self.persist = persist
+        with metrics.timed('db'):
+            self.cards = known_cards if known_cards is not None else db.get_known_cards([reda_name])
+            self.failures = failures if failures is not None else db.get_card_failures([reda_name])
+            self.catalog = catalog if catalog is not None else db.get_catalog([reda_name])
+        self.resolved = {}
+        self._catalog_index = None
+
+    def resolve(self, name):
+        """Returns card by its shop listing name, card is a copy, so it may be changed by caller
+
+        :param name: card name from shop listing
+        :return: models.Card or None
+        """
+        card = self.cards.get((name, self.reda_name))
+        if card is not None:
+            return card.copy()
+
+        key = (ext.normalize_name(name), self.reda_name)
+        if key in self.failures:
+            return None
+
+        if key not in self.resolved:
+            self.resolved[key] = card_flights.do(key, self._resolve_upstream, name, key)
+
+        card = self.resolved[key]
+        return card.copy() if card is not None else None
+
+    def _resolve_upstream(self, name, key):
+        """
+        Resolves card by catalog or by magiccards search
+        """
+        entry = self.catalog.get(key)
+        if entry is None:
+            entry = self._match_catalog(name)
+        if entry is not None:
+            card, reason = self._get_catalog_card(entry), 'no tcgplayer sid'
+        else:
+            card, reason = MagiccardsScraper.find_card(name, self.reda_name)
+
+        if card is None:
+            self.failures[key] = reason
+            if self.persist:
+                db.save_card_failure(key[0], self.reda_name, reason)
+
+        return card
+
+    def _match_catalog(self, name):
+        """Finds catalog entry by fuzzy matching of name with catalog names
+
+        :param name: card name from shop listing
+        :return: catalog entry dict or None
+        """
+        if self._catalog_index is None:
+            self._catalog_index = fuzzy.NameIndex(name for name, reda in self.catalog)
+
+        matched = self._catalog_index.best(name, min_score=FUZZY_MIN_SCORE)
+        return self.catalog[(matched, self.reda_name)] if matched is not None else None
+
+    def _get_catalog_card(self, entry):
+        """Builds card of catalog entry, card page is fetched only if entry has no tcgplayer sid yet
+
+        :param entry: catalog entry dict
+        :return: models.Card or None if card page has no tcgplayer sid, e.g. it isn't english
+        """
+        if not entry.get('sid'):
+            sid = MagiccardsScraper.extract_page(openurl(entry['url'])).sid
+            if sid is None:
+                return None
+
+            entry['sid'] = sid
+            if self.persist:
+                db.set_catalog_sid(entry['name'], self.reda_name, sid)
+
+        prices = TCGPlayerScraper(entry['sid']).get_brief_info()
+        return models.Card(entry['title'], self.reda_name, entry['rarity'],
+                           models.CardInfo(entry['url'], entry['img_url']), models.CardPrices(**prices))
+
+
+def save_shops_cards(shops, reda, checkpoint=None):
+    """Scrapes redaction at several shops concurrently and saves cards as they are resolved
+    in batches of db.STREAM_BATCH_SIZE. Cards are resolved by one shared resolver,
+    so each card is resolved upstream at most once.
+    Listing page is checkpointed when its cards are saved, redaction of shop when all its pages are,
+    finished redactions and pages of checkpoint are skipped.
+    Rows with the same fingerprint as stored offer are neither resolved nor saved,
+    offers that aren't listed anymore are removed if whole listing was read in this run
+
+    :param shops: list of scraper classes
+    :param reda: models.Redaction
+    :param checkpoint: checkpoints.Checkpoint of run, in-memory one if None
+    :return: dict {shop name: dict {new, changed, unchanged, delisted}}, shops which redaction
+        is finished by checkpoint aren't scraped and are left out
+    """
+    checkpoint = checkpoint or checkpoints.Checkpoint()
+    shops = [shop for shop in shops if not checkpoint.is_reda_done(shop.SHOP_NAME, reda.name)]
+    if not shops:
+        return {}
+    resolver = CardResolver(reda.name)
+
+    def save_shop(shop):
+        changes = ListingChanges(shop.SHOP_NAME, reda.name)
+
+        def save_page(page):
+            db.save_cards(_get_page_cards(shop, reda, page, resolver, checkpoint, changes),
+                          shop=shop.SHOP_NAME, batch_size=db.STREAM_BATCH_SIZE)
+            checkpoint.page_done(shop.SHOP_NAME, page[0])
+
+        listing = retry(shop.get_listing, reda)
+        pages = [page for page in listing if not checkpoint.is_page_done(shop.SHOP_NAME, page[0])]
+        for _ in stream_map(save_page, pages, LISTING_PAGES_IN_FLIGHT):
+            pass
+
+        if len(pages) == len(listing):
+            changes.report['delisted'] = db.remove_shop_offers(shop.SHOP_NAME, reda.name, changes.get_delisted())
+
+        checkpoint.reda_done(shop.SHOP_NAME, reda.name)
+        return shop.SHOP_NAME, changes.report
+
+    return dict(spawn_map(save_shop, shops))
+
+
+def get_shop_cards(shop, reda, resolver, checkpoint=None):
+    """Scrapes all listing pages of redaction at shop one by one
+
+    :param shop: scraper class
+    :param reda: models.Redaction
+    :param resolver: CardResolver
+    :param checkpoint: checkpoints.Checkpoint that records failed rows, in-memory one if None
+    :return: generator of models.Card, cards are yielded as they are resolved
+    """
+    checkpoint = checkpoint or checkpoints.Checkpoint()
+    for page in retry(shop.get_listing, reda):
+        for card in _get_page_cards(shop, reda, page, resolver, checkpoint):
+            yield card
+
+
+def _get_page_cards(shop, reda, page, resolver, checkpoint, changes=None):
+    """Resolves rows of listing page, row that fails after retries is recorded by checkpoint and skipped
+
+    :param shop: scraper class
+    :param reda: models.Redaction
+    :param page: tuple (page url, list of extractors.ShopRow or None if page isn't fetched yet)
+    :param resolver: CardResolver
+    :param checkpoint: checkpoints.Checkpoint
+    :param changes: ListingChanges, unchanged rows are skipped if given
+    :return: generator of models.Card
+    """
+    url, rows = page
+    if rows is None:
+        rows = retry(shop.get_page_rows, url)
+    if changes is not None:
+        rows = [row for row in rows if not changes.is_unchanged(row)]
+
+    def resolve(row):
+        try:
+            card = retry(shop._parse_card_shop_info, (row, resolver))
+        except Exception as e:
+            checkpoint.row_failed(shop.SHOP_NAME, reda.name, row, e)
+            return None
+
+        if card is not None:
+            card.shops[shop.SHOP_NAME].fingerprint = row_fingerprint(row)
+            if changes is not None:
+                changes.resolved(row)
+        return card
+
+    for card in stream_map(resolve, rows):
+        if card is not None:
+            yield card
+
+
+def row_fingerprint(row):
+    """Fingerprints shop listing row by url, price as shop shows it and stock
+
+    :param row: extractors.ShopRow
+    :return: hex digest string
+    """
+    price = row.uah_price if row.uah_price is not None else row.price
+    return hashlib.md5(repr((row.url, price, row.number))).hexdigest()
+
+
+class ListingChanges(object):
+    """
+    Compares shop listing rows of redaction with offers stored by previous runs
+    """
+
+    def __init__(self, shop_name, reda_name):
+        self.known = db.get_offer_fingerprints(shop_name, reda_name)
+        self.seen = set()
+        self.report = {'new': 0, 'changed': 0, 'unchanged': 0, 'delisted': 0}
+
+    def is_unchanged(self, row):
+        """
+        Marks row as listed and returns True if stored offer has the same fingerprint
+        """
+        self.seen.add(row.url)
+        known = self.known.get(row.url)
+        if known is not None and known[1] == row_fingerprint(row):
+            self.report['unchanged'] += 1
+            return True
+        return False
+
+    def resolved(self, row):
+        """Counts resolved row as new or changed offer
+
+        :param row: extractors.ShopRow
+        """
+        self.report['changed' if row.url in self.known else 'new'] += 1
+
+    def get_delisted(self):
+        """
+        Returns cards which stored offer url wasn't listed, as tuples (card name, offer url)
+        """
+        return [(name, url) for url, (name, fingerprint) in self.known.items() if url not in self.seen]
+
+
+def refresh_prices(max_age, budget):
+    """Refetches tcgplayer prices of cards which prices are older than max_age,
+    most valuable cards are refreshed first and at most budget sids are fetched.
+    Cached tcgplayer responses older than max_age are revalidated, younger ones are used as is.
+    Overpay of card shop offers is recomputed by new prices
+
+    :param max_age: prices age in seconds
+    :param budget: max number of tcgplayer fetches
+    :return: dict {fetched: number of sids fetched from tcgplayer, cache hits aren't counted, failed, updated}
+    """
+    cards = db.get_stale_cards(max_age, budget)
+    sids = list(set(card.prices.sid for card in cards))
+    started = datetime.datetime.utcnow()
+
+    def fetch(sid):
+        try:
+            return sid, TCGPlayerScraper(sid).get_brief_info(max_age)
+        except Exception:
+            return sid, None
+
+    prices = dict(spawn_map(fetch, sids))
+    updated = []
+    for card in cards:
+        if prices[card.prices.sid] is not None:
+            card.prices = models.CardPrices(**prices[card.prices.sid])
+            card.refresh_overpay()
+            updated.append(card)
+
+    db.save_prices(updated)
+    # prices served from cache keep fetch time of cached response, fetched ones are stamped after start
+    return {'fetched': sum(1 for p in prices.values() if p is None or p['updated'] >= started),
+            'failed': sum(1 for p in prices.values() if p is None), 'updated': len(updated)}
+
+
+def build_catalog(redas):
+    """Parses magiccards set listings of redactions and saves them to catalog,
+    redaction which listing fails is skipped, so catalogs of other redactions are still saved
+
+    :param redas: list of models.Redaction
+    :return: dict {saved: number of saved catalog entries, failed: dict {redaction name: error}}
+    """
+    def fetch(reda):
+        try:
+            return reda, MagiccardsScraper.get_catalog(reda), None
+        except Exception as e:
+            return reda, None, e
+
+    saved, failed = 0, {}
+    for reda, entries, error in spawn_map(fetch, redas):
+        if error is not None:
+            failed[reda.name] = repr(error)
+        else:
+            saved += db.save_catalog(reda.name, entries)
+
+    return {'saved': saved, 'failed': failed}
+
+
 def openurl(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/27.0.1453.110 Safari/537.36',
-        'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.6,en;q=0.4',
-        'Accept-Encoding': 'gzip,deflate',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Cache-Control': 'max-age=0'
-    }
+    """Fetches page using shared keep-alive transport, pages that have cache policy
+    are served from responses cache while fresh and revalidated after
+
+    :param url: page url, non ascii symbols are encoded
+    :return: decoded page body
+    """
+    return responses_cache.fetch(http, ext.iriToUri(url), HEADERS)
 
-    opener = urllib2.build_opener()
-    opener.addheaders = headers.items()
-    response = opener.open(ext.iriToUri(url))
 
-    if response.info().get('Content-Encoding') == 'gzip':
-        buf = StringIO(response.read())
-        response = gzip.GzipFile(fileobj=buf)
+def openurl_with_time(url, max_age=None):
+    """Same as openurl, but also tells when returned page was fetched,
+    page served from responses cache may be fetched long ago
 
-    page = response.read()
-    return page
+    :param url: page url, non ascii symbols are encoded
+    :param max_age: seconds, cached page older than this is revalidated, cache policy decides if None
+    :return: tuple (decoded page body, utc datetime of fetch)
+    """
+    body, fetched = responses_cache.fetch_with_time(http, ext.iriToUri(url), HEADERS, max_age)
+    return body, datetime.datetime.utcfromtimestamp(fetched)
 
 
 class MagiccardsScraper(object):
@@ -49,161 +461,165 @@ class MagiccardsScraper(object):
     Parses cards info using www.magiccards.info resource
     """
 
-    MAGICCARDS_BASE_URL = 'http://magiccards.info/'
+    MAGICCARDS_BASE_URL = extractors.MAGICCARDS_BASE_URL
     MAGICCARDS_REDACTIONS_URL = 'sitemap.html'
     MAGICCARDS_QUERY_TMPL = 'query?q=!%s&v=card&s=cname'
 
     @staticmethod
     def get_card(name, redaction):
-        """Parses card info, if no info returns card object without info and prices
+        """Parses card info, if card isn't found returns None
 
         :return: models.Card object
         """
+        return MagiccardsScraper.find_card(name, redaction)[0]
+
+    @staticmethod
+    def find_card(name, redaction):
+        """Parses card info and explains failure if card isn't found
+
+        :return: tuple (models.Card or None, failure reason or None)
+        """
         page_url = MagiccardsScraper.MAGICCARDS_BASE_URL + MagiccardsScraper.MAGICCARDS_QUERY_TMPL % urllib2.quote(name)
-        page = openurl(page_url)
-        soup = BeautifulSoup(page)
+        card_page = MagiccardsScraper.extract_page(openurl(page_url))
 
         # if card was not found by name, try to use magiccards hints
-        if not MagiccardsScraper._is_card_page(soup):
-            hint = MagiccardsScraper._try_get_hint(name, soup)
+        if not MagiccardsScraper._is_card_page(card_page):
+            hint = MagiccardsScraper._try_get_hint(name, card_page)
             if hint is None:
-                return None
+                return None, 'no hint'
 
-            name = hint.text
-            page_url = ext.url_join(ext.get_domain(page_url), hint['href'])
-            page = openurl(page_url)
-            soup = BeautifulSoup(page)
+            name, hint_href = hint
+            page_url = ext.url_join(ext.get_domain(page_url), hint_href)
+            card_page = MagiccardsScraper.extract_page(openurl(page_url))
 
         # if card is found, but it's not english
-        if not MagiccardsScraper._is_en(soup):
-            en_link_tag = list(soup.find_all('table')[3].find_all('td')[2].find('img', alt='English').next_elements)[1]
-            name = en_link_tag.text
-            page_url = ext.url_join(ext.get_domain(page_url), en_link_tag['href'])
-            page = openurl(page_url)
-            soup = BeautifulSoup(page)
+        if not MagiccardsScraper._is_en(card_page):
+            if card_page.en_link is None:
+                return None, 'no english printing'
+
+            name, en_href = card_page.en_link
+            page_url = ext.url_join(ext.get_domain(page_url), en_href)
+            card_page = MagiccardsScraper.extract_page(openurl(page_url))
 
         # if card redaction is wrong, try to get correct
-        if not MagiccardsScraper._reda_is(redaction, soup):
-            page_url = MagiccardsScraper._get_correct_reda(redaction, soup)
+        if not MagiccardsScraper._reda_is(redaction, card_page):
+            page_url = MagiccardsScraper._get_correct_reda(redaction, card_page)
             if page_url is None:
-                return None
+                return None, 'no redaction printing'
 
-            page = openurl(page_url)
-            soup = BeautifulSoup(page)
+            card_page = MagiccardsScraper.extract_page(openurl(page_url))
 
-        type = MagiccardsScraper._get_card_type(soup)
-        info = MagiccardsScraper._get_card_info(soup)
-        price = MagiccardsScraper._get_prices(soup)
+        type = MagiccardsScraper._get_card_type(card_page)
+        info = MagiccardsScraper._get_card_info(card_page)
+        price = MagiccardsScraper._get_prices(card_page)
 
         card_info = models.CardInfo(**info)
         card_prices = models.CardPrices(**price)
 
-        return models.Card(ext.uni(name), ext.uni(redaction), type, card_info, card_prices)
+        return models.Card(ext.uni(name), ext.uni(redaction), type, card_info, card_prices), None
+
+    @staticmethod
+    def extract_page(page):
+        """Parses magiccards page in parse worker process
+
+        :param page: page html
+        :return: extractors.MagiccardsPage
+        """
+        return parsing.run(extractors.extract_magiccards_page, page)
 
     @staticmethod
-    def _is_en(soup):
+    def _is_en(card_page):
         """
         Checks if found card is en
         """
-        en_link = list(soup.find_all('table')[3].find_all('td')[2].find('img', alt='English').next_elements)[1]
-        return en_link.name == 'b'
+        return card_page.is_en
 
     @staticmethod
-    def _reda_is(reda, soup):
+    def _reda_is(reda, card_page):
         """Checks if card redaction is correct
 
         :param reda: required card redaction
-        :param soup: soup of card page
+        :param card_page: extractors.MagiccardsPage of card page
         """
-        content_table = soup.find_all('table')[3]
-        redas_td = content_table.find_all('td')[2]
-
-        redas_bs = redas_td.find_all('b')
-        # for double sided card 4
-        reda_index = 3 if len(redas_bs) == 5 else 4
-        return ext.uni(redas_bs[reda_index].text.split('(')[0]) == reda
+        return card_page.redaction == reda
 
     @staticmethod
-    def _get_correct_reda(reda, soup):
+    def _get_correct_reda(reda, card_page):
         """Searches correct redaction for card and returns it's url
 
         :param reda: required card redaction
-        :param soup: soup of card page
+        :param card_page: extractors.MagiccardsPage of card page
         """
-        content_table = soup.find_all('table')[3]
-        redas_td = content_table.find_all('td')[2]
-
-        for reda_tag in redas_td.find_all('a'):
-            if reda_tag.text.strip().lower() == reda:
-                return ext.url_join(ext.get_domain(MagiccardsScraper.MAGICCARDS_BASE_URL), reda_tag['href'])
+        for reda_name, reda_href in card_page.printings:
+            if reda_name == reda:
+                return ext.url_join(ext.get_domain(MagiccardsScraper.MAGICCARDS_BASE_URL), reda_href)
 
         return None
 
     @staticmethod
-    def _is_card_page(soup):
-        """Parses soup page and find out is page has card info
+    def _is_card_page(card_page):
+        """Checks if page has card info
 
-        :param soup: soup page from www.magiccards.info
+        :param card_page: extractors.MagiccardsPage
         :return: boolean value
         """
-        return len(soup.find_all('table')) > 2
+        return card_page.is_card
 
     @staticmethod
-    def _try_get_hint(name, soup):
-        """Parses soup page and tries find out card hint.
+    def _try_get_hint(name, card_page):
+        """Tries find out card hint on search page.
         Selects hint that has max affinity with base card name.
 
         :param name: cards name
-        :param soup: soup page from www.magiccards.info
-        :return: tag 'a' with hint
+        :param card_page: extractors.MagiccardsPage of search page
+        :return: tuple (hint text, hint href)
         """
-        hints_list = []
-        for hint_li in soup.find_all('li'):
-            hint_tag = hint_li.contents[0]
-            resemble_rate = difflib.SequenceMatcher(a=ext.uni(name), b=ext.uni(hint_li.contents[0].text)).ratio()
-            hints_list.append({'a_tag': hint_tag, 'rate': resemble_rate})
+        if not card_page.hints:
+            return None
 
-        return sorted(hints_list, key=lambda h: h['rate'], reverse=True)[0]['a_tag'] if hints_list else None
+        hints = dict(card_page.hints)
+        best = fuzzy.NameIndex(hints.keys()).best(name)
+        return (best, hints[best]) if best is not None else card_page.hints[0]
 
     @staticmethod
-    def _get_card_type(soup):
-        """Parses soup page and returns card type (rare, common, etc.)
+    def _get_card_type(card_page):
+        """Returns card type (rare, common, etc.)
 
-        :param soup: soup page from www.magiccards.info
+        :param card_page: extractors.MagiccardsPage of card page
         :return: card type as string
         """
-        redas_bs = soup.find_all('table')[3].find_all('td')[2].find_all('b')
-        # if double sided card
-        reda_index = 3 if len(redas_bs) == 5 else 4
-        return ext.uni(redas_bs[reda_index].text.split('(')[1][:-1])
+        return card_page.rarity
 
     @staticmethod
-    def _get_card_info(soup):
-        """Parses soup page and returns dict with card info
+    def _get_card_info(card_page):
+        """Returns dict with card info
 
-        :param soup: soup page from www.magiccards.info
+        :param card_page: extractors.MagiccardsPage of card page
         :return: dictionary with card info
         """
-        content_table = soup.find_all('table')[3]
-        return {'url': ext.url_join(MagiccardsScraper.MAGICCARDS_BASE_URL, content_table.find_all('a')[0]['href']),
-                'img_url': content_table.find_all('img')[0]['src']}
+        return {'url': card_page.url, 'img_url': card_page.img_url}
 
     @staticmethod
-    def _get_prices(magic_soup):
+    def _get_prices(card_page):
         """Parses prices by TCGPlayer card sid
 
-        :param magic_soup: soup page from www.magiccards.info
+        :param card_page: extractors.MagiccardsPage of card page
         :return: dictionary with prices from TCGPlayer in format {sid, low, mid, high}
         """
-        content_table = magic_soup.find_all('table')[3]
-        request_url = content_table.find_all('script')[0]['src']
-        sid = ext.uni(ext.get_query_string_params(request_url)['sid'])
-
-        tcg_scrapper = TCGPlayerScraper(sid)
+        tcg_scrapper = TCGPlayerScraper(card_page.sid)
         prices = tcg_scrapper.get_brief_info()
 
         return prices
 
+    @staticmethod
+    def get_catalog(reda):
+        """Parses magiccards set listing of redaction
+
+        :param reda: models.Redaction
+        :return: list of extractors.CatalogEntry
+        """
+        return parsing.run(extractors.extract_magiccards_set, openurl(reda.url))
+
     @staticmethod
     def get_redas():
         """Parses www.magiccards.info for available redactions
@@ -212,14 +628,10 @@ class MagiccardsScraper(object):
         """
         page_url = ext.url_join(MagiccardsScraper.MAGICCARDS_BASE_URL, MagiccardsScraper.MAGICCARDS_REDACTIONS_URL)
         page = openurl(page_url)
-        soup = BeautifulSoup(page)
 
-        en_reda_table = soup.find_all('table')[1]
         redas = []
         redas_synonyms = MagiccardsScraper._get_redas_synonyms()
-        for reda_a in en_reda_table.find_all('a'):
-            name = ext.uni(reda_a.text)
-            url = ext.url_join(MagiccardsScraper.MAGICCARDS_BASE_URL, reda_a['href'])
+        for name, url in parsing.run(extractors.extract_magiccards_redas, page):
             reda_synonyms = redas_synonyms.get(name, [])
 
             redas.append(models.Redaction(name, url, reda_synonyms))
@@ -262,22 +674,18 @@ class TCGPlayerScraper(object):
         """
         return self.BRIEF_BASE_URL + self.sid
 
-    def get_brief_info(self):
+    def get_brief_info(self, max_age=None):
         """Parses summary price info for card
 
-        :return: dictionary {sid, tcg card url, low, mid, high}
+        :param max_age: seconds, cached prices older than this are refetched, cache policy decides if None
+        :return: dictionary {sid, tcg card url, low, mid, high, updated}
         """
-        tcg_response = openurl(self.brief_url)
-        html_response = tcg_response.replace('\'+\'', '').replace('\\\'', '"')[16:][:-3]
-
-        tcg_soup = BeautifulSoup(html_response)
-
-        prices = {'sid': ext.uni(self.sid),
-                  'url': ext.get_domain_with_path(tcg_soup.find('td', class_='TCGPHiLoLink').contents[0]['href']),
-                  'low': ext.price_to_float(ext.uni(tcg_soup.find('td', class_='TCGPHiLoLow').contents[1].contents[0])),
-                  'mid': ext.price_to_float(ext.uni(tcg_soup.find('td', class_='TCGPHiLoMid').contents[1].contents[0])),
-                  'high': ext.price_to_float(ext.uni(tcg_soup.find('td', class_='TCGPHiLoHigh').contents[1].contents[0]))}
+        return price_flights.do(self.sid, self._get_brief_info, max_age)
 
+    def _get_brief_info(self, max_age):
+        tcg_response, fetched = openurl_with_time(self.brief_url, max_age)
+        prices = parsing.run(extractors.extract_tcg_prices, tcg_response, self.sid)
+        prices['updated'] = fetched
         return prices
 
 
@@ -286,7 +694,7 @@ class SpellShopScraper(object):
     Represents parser for www.spellshop.com.ua
     """
 
-    BASE_URL = 'http://spellshop.com.ua/index.php?categoryID=90'
+    BASE_URL = extractors.SPELLSHOP_BASE_URL
     SHOP_NAME = u'spellshop'
 
     @staticmethod
@@ -297,17 +705,8 @@ class SpellShopScraper(object):
         :returns: list of updated models.Redaction
         """
         page = openurl(SpellShopScraper.BASE_URL)
-        soup = BeautifulSoup(page)
-
-        menu_list = soup.find_all('td', class_='menu_body')[1]
-        redactions_container = menu_list.find('table').contents[1].contents[0]
-        redaction_divs = redactions_container.find_all('div')[3:37]
-
-        for rdiv in redaction_divs:
-            reda_tag = rdiv.find('a')
-            name = ext.uni(reda_tag.text)
-            url = ext.url_join(ext.get_domain(SpellShopScraper.BASE_URL), reda_tag['href'])
 
+        for name, url in parsing.run(extractors.extract_spellshop_redas, page):
             reda = ext.get_first(redas, lambda r: name in r.names)
             if reda is None:
                 raise Exception('unknown redaction is found: ' + name)
@@ -317,58 +716,53 @@ class SpellShopScraper(object):
         return redas
 
     @staticmethod
-    def get_cards(reda):
+    def get_cards(reda, known_cards=None, resolver=None):
         """Parses www.spellshop.com.ua to find all available card for reda redaction
 
         :param reda: cards redaction, object of models.Redaction
-        :return: list of models.Card
+        :param known_cards: dict of cards {(name, redaction): models.Card}, loaded from db if None
+        :param resolver: CardResolver shared with other shops, created if None
+        :return: generator of models.Card, cards are yielded as they are resolved
         """
-        url = reda.shops[SpellShopScraper.SHOP_NAME] + '&show_all=yes'
-        page = openurl(url)
-        soup = BeautifulSoup(page)
+        return get_shop_cards(SpellShopScraper, reda, resolver or CardResolver(reda.name, known_cards))
+
+    @staticmethod
+    def get_listing(reda):
+        """Returns listing pages of redaction, all cards are shown at one page
 
-        cards_table = soup.find('td', class_='td_center')
-        cards = []
-        if cards_table is not None:
-            cards_divs = filter(lambda d: ext.uni(d.text), cards_table.find_all('div'))
-            if len(cards_divs) == 0:
-                return cards
+        :param reda: models.Redaction
+        :return: list of tuples (page url, None)
+        """
+        return [(reda.shops[SpellShopScraper.SHOP_NAME] + '&show_all=yes', None)]
 
-            pool = eventlet.GreenPool(len(cards_divs) if len(cards_divs) < 100 else 100)
-            for card in pool.imap(SpellShopScraper._parse_card_shop_info, map(lambda cd: (cd, reda), cards_divs)):
-                if card is not None:
-                    cards.append(card)
+    @staticmethod
+    def get_page_rows(page_url):
+        """Parses card offers that found at page
 
-        return cards
+        :param page_url: listing page url
+        :return: list of extractors.ShopRow
+        """
+        return parsing.run(extractors.extract_spellshop_rows, openurl(page_url), db.get_uah_rate())
 
     @staticmethod
     def _parse_card_shop_info(args):
-        """Parses card shop info and find this card at www.magiccard.info
+        """Finds card of shop listing row at www.magiccard.info
 
-        :param args: tuple of (soup tag with card info, models.Redaction)
+        :param args: tuple of (extractors.ShopRow, CardResolver)
         :return: models.Card
         """
-        card_div, reda = args
-        card_tr = card_div.find('tr')
-        card_tds = card_tr.find_all('td')
-
-        name = ext.uni(card_tds[1].find('a').text)
-        if name.split()[0] in ['mountain', 'swamp', 'island', 'plains', 'forest']:
+        row, resolver = args
+        if row.name.split()[0] in ['mountain', 'swamp', 'island', 'plains', 'forest']:
             return None
 
-        url = ext.url_join(ext.get_domain(SpellShopScraper.BASE_URL), card_tds[1].find('a')['href'])
-        price = ext.price_to_float(ext.uah_to_dollar(card_tds[4].text))
-        number = len(card_tds[5].find_all('option'))
-
-        card = db.get_card(name, reda.name)
-        if card is None:
-            card = MagiccardsScraper.get_card(name, reda.name)
-
-        if card is None:
+        card = resolver.resolve(row.name)
+        # card without tcgplayer prices has no overpay
+        if card is None or card.prices is None:
             return None
 
         card.shops[SpellShopScraper.SHOP_NAME] = \
-            models.Shop(SpellShopScraper.SHOP_NAME, url, price, card.prices.avg / price, number)
+            models.Shop(SpellShopScraper.SHOP_NAME, row.url, row.price, card.prices.avg / row.price, row.number,
+                        uah_price=row.uah_price)
 
         return card
 
@@ -378,7 +772,7 @@ class BuyMagicScraper(object):
     Represents parser for www.buymagic.ua
     """
 
-    BASE_URL = 'http://www.buymagic.com.ua/'
+    BASE_URL = extractors.BUYMAGIC_BASE_URL
     SHOP_NAME = u'buymagic'
 
     @staticmethod
@@ -389,112 +783,65 @@ class BuyMagicScraper(object):
         :returns: list of updated models.Redaction
         """
         page = openurl(BuyMagicScraper.BASE_URL)
-        page = page \
-            .replace('"bordercolor="#000000" bgcolor="#FFFFFF"', '') \
-            .replace('<link rel="stylesheet" href="/jquery.fancybox-1.3.0.css" type="text/css" media="screen">', '') \
-            .replace('"title=', '" title=')
-        soup = BeautifulSoup(page, from_encoding='utf-8')
 
-        root_div = soup.find_all('div', class_='c1')[1]
-        for reda_ul in root_div.find_all('ul')[1:]:
-            for reda_tag in reda_ul.find_all('a'):
-                name = ext.uni(reda_tag.text)
-                url = reda_tag['href']
-
-                reda = ext.get_first(redas, lambda r: name in r.names)
-                if reda is None:
-                    raise Exception('unknown redaction is found: ' + name)
+        for name, url in parsing.run(extractors.extract_buymagic_redas, page):
+            reda = ext.get_first(redas, lambda r: name in r.names)
+            if reda is None:
+                raise Exception('unknown redaction is found: ' + name)
 
-                reda.shops[BuyMagicScraper.SHOP_NAME] = url
+            reda.shops[BuyMagicScraper.SHOP_NAME] = url
 
         return redas
 
     @staticmethod
-    def get_cards(reda):
+    def get_cards(reda, known_cards=None, resolver=None):
         """Parses www.buymagic.ua to find all available card for reda redaction
 
         :param reda: cards redaction, object of models.Redaction
-        :return: list of models.Card
+        :param known_cards: dict of cards {(name, redaction): models.Card}, loaded from db if None
+        :param resolver: CardResolver shared with other shops, created if None
+        :return: generator of models.Card, cards are yielded as they are resolved
         """
-        page_url = reda.shops[BuyMagicScraper.SHOP_NAME]
-        page = openurl(page_url)
-        page = page \
-            .replace('"bordercolor="#000000" bgcolor="#FFFFFF"', '') \
-            .replace('<link rel="stylesheet" href="/jquery.fancybox-1.3.0.css" type="text/css" media="screen">', '') \
-            .replace('"title=', '" title=')
-        soup = BeautifulSoup(page, from_encoding='utf-8')
-
-        pager_div = soup.find('div', class_='c2').contents[5]
-        pages_tags = pager_div.find_all('a')
-
-        pages = [page_url]
-        pages += [ext.url_join(ext.get_domain(BuyMagicScraper.BASE_URL), tag['href']) for tag in pages_tags]
-
-        cards = []
-        pool = eventlet.GreenPool(len(pages))
-        for page_cards in pool.imap(BuyMagicScraper._parse_cards_at_page, map(lambda p: (p, reda), pages)):
-            if page_cards is not None:
-                cards += page_cards
-
-        return cards
+        return get_shop_cards(BuyMagicScraper, reda, resolver or CardResolver(reda.name, known_cards))
 
     @staticmethod
-    def _parse_cards_at_page(args):
-        """Parses cards that found at current page
+    def get_listing(reda):
+        """Returns listing pages of redaction, first page is parsed to find pager links
 
-        :param args: tuple of (page url, models.Redaction)
-        :return: list of models.Card or None
+        :param reda: models.Redaction
+        :return: list of tuples (page url, list of extractors.ShopRow or None if page isn't fetched yet)
         """
-        page_url, reda = args
-        page = openurl(page_url)
-        page = page \
-            .replace('"bordercolor="#000000" bgcolor="#FFFFFF"', '') \
-            .replace('<link rel="stylesheet" href="/jquery.fancybox-1.3.0.css" type="text/css" media="screen">', '') \
-            .replace('"title=', '" title=')
-        soup = BeautifulSoup(page, from_encoding='utf-8')
-
-        root_div = soup.find('div', class_='c2')
-        card_divs = filter(lambda r: isinstance(r, Tag), list(root_div.find('p').children))[:-1]
+        page_url = reda.shops[BuyMagicScraper.SHOP_NAME]
+        pages, rows = parsing.run(extractors.extract_buymagic_page, openurl(page_url), True, db.get_uah_rate())
+        return [(page_url, rows)] + [(url, None) for url in pages]
 
-        cards = []
-        pool = eventlet.GreenPool(len(card_divs))
-        args = map(lambda d: (d, reda), card_divs)
-        for card in pool.imap(BuyMagicScraper._parse_card_shop_info, args):
-            if card is not None:
-                cards.append(card)
+    @staticmethod
+    def get_page_rows(page_url):
+        """Parses card offers that found at page
 
-        return cards
+        :param page_url: listing page url
+        :return: list of extractors.ShopRow
+        """
+        # pager links are extracted only from the first page
+        return parsing.run(extractors.extract_buymagic_page, openurl(page_url), False, db.get_uah_rate())[1]
 
     @staticmethod
     def _parse_card_shop_info(args):
-        """Parses card shop info and find this card at www.magiccard.info
+        """Finds card of shop listing row at www.magiccard.info
 
-        :param args: tuple of (soup tag with card info, models.Redaction)
+        :param args: tuple of (extractors.ShopRow, CardResolver)
         :return: models.Card or None
         """
-        card_div, reda = args
-        inner_div = card_div.find('div')
-        if inner_div is not None:
-            card_div = inner_div
-
-        header_tag = card_div.find('a')
-        url = ext.uni(header_tag['href'])
-        name = ext.uni(header_tag.text)
-
-        price_table = card_div.find('table')
-        price_row = price_table.find('tr').find_all('td')
+        row, resolver = args
         type = 'common'
-        price = ext.price_to_float(ext.uah_to_dollar(ext.uni(price_row[1].text)))
-        number = len(price_row[2].find_all('option'))
-
-        card = db.get_card(name, reda.name)
-        if card is None:
-            card = MagiccardsScraper.get_card(name, reda.name)
 
-        if card is None:
+        card = resolver.resolve(row.name)
+        # card without tcgplayer prices has no overpay
+        if card is None or card.prices is None:
             return None
 
         card.shops[BuyMagicScraper.SHOP_NAME] = \
-            models.Shop(BuyMagicScraper.SHOP_NAME, url, price, card.prices.avg / price, number, type=type)
+            models.Shop(BuyMagicScraper.SHOP_NAME, row.url, row.price, card.prices.avg / row.price, row.number,
+                        type=type, uah_price=row.uah_price)
 
         return card
@@ -0,0 +1,41 @@
+import sys
+from eventlet.event import Event
+
+
+class SingleFlight(object):
+    """
+    Deduplicates concurrent calls: green threads that call with the same key
+    while first call is in flight wait for its result instead of calling again
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, *args):
+        """Calls func or waits for result of in-flight call with the same key,
+        exception of in-flight call is raised in every waiting green thread
+
+        :param key: hashable key
+        :param func: function
+        :param args: function arguments
+        :return: function result
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            return call.wait()
+
+        self.calls += 1
+        call = self._calls[key] = Event()
+        try:
+            result = func(*args)
+        except Exception:
+            call.send_exception(*sys.exc_info())
+            raise
+        else:
+            call.send(result)
+            return result
+        finally:
+            del self._calls[key]
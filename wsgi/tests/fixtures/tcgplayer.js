@@ -0,0 +1 @@
+document.write('<table class=\'TCGPHi'+'LoTable\'><tr><td class=\'TCGPHiLoLink\'><a href=\'http://store.tcgplayer.com/magic/magic-2014-core-set/shock?partner=MAGCINFO\' target=\'_blank\'>Shock</a></td></tr><tr><td class=\'TCGPHiLoLow\'>L: <a href=\'http://store.tcgplayer.com/magic/magic-2014-core-set/shock?partner=MAGCINFO\'>$0.05</a></td><td class=\'TCGPHiLoMid\'>M: <a href=\'http://store.tcgplayer.com/magic/magic-2014-core-set/shock?partner=MAGCINFO\'>$0.19</a></td><td class=\'TCGPHiLoHigh\'>H: <a href=\'http://store.tcgplayer.com/magic/magic-2014-core-set/shock?partner=MAGCINFO\'>$1.25</a></td></tr></table>');
\ No newline at end of file
@@ -0,0 +1,118 @@
+import unittest
+import mongomock
+import db
+import models
+
+
+def make_card(name, reda, overpay, shop='spellshop'):
+    prices = models.CardPrices('1', 'http://tcg/' + name, 1., 2., 3.)
+    card = models.Card(name, reda, 'common', info=models.CardInfo('http://mc/' + name, 'http://mc/img'), prices=prices)
+    card.shops[shop] = models.Shop(shop, 'http://shop/' + name, 1., overpay, 1)
+    return card
+
+
+class CardsPageTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        # equal overpays make _id the tie breaker
+        overpays = [5., 4., 4., 4., 3., 2., 2., 1.]
+        cards = [make_card('card %d' % i, 'm14', overpay) for i, overpay in enumerate(overpays)]
+        db.save_cards(cards, shop='spellshop')
+
+    def tearDown(self):
+        db.set_client(None)
+
+    def test_after_token_walks_listing_in_skip_order(self):
+        expected = [card.name for card in db.get_cards_page('spellshop', limit=100)[0]]
+
+        walked, token = [], None
+        while True:
+            cards, first, last = db.get_cards_page('spellshop', limit=3, after=token)
+            if not cards:
+                break
+            walked += [card.name for card in cards]
+            token = last
+
+        self.assertEqual(walked, expected)
+
+    def test_before_token_returns_previous_page(self):
+        first_page, first_token, last_token = db.get_cards_page('spellshop', limit=3)
+        second_page, second_first, second_last = db.get_cards_page('spellshop', limit=3, after=last_token)
+
+        previous_page = db.get_cards_page('spellshop', limit=3, before=second_first)[0]
+
+        self.assertEqual([card.name for card in previous_page], [card.name for card in first_page])
+
+    def test_malformed_token_raises_value_error(self):
+        self.assertRaises(ValueError, db.get_cards_page, 'spellshop', after='not a token')
+
+
+class CountersTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+
+    def tearDown(self):
+        db.set_client(None)
+
+    def test_counters_count_only_new_offers(self):
+        db.save_cards([make_card('a', 'm14', 1.), make_card('b', 'm14', 1.)], shop='spellshop')
+        db.save_cards([make_card('b', 'm14', 2.), make_card('c', 'm14', 1.), make_card('d', 'm13', 1.)],
+                      shop='spellshop')
+
+        self.assertEqual(db.get_cards_count('spellshop', ['m14']), 3)
+        self.assertEqual(db.get_cards_count('spellshop', ['m13']), 1)
+        self.assertEqual(db.get_cards_count('spellshop'), 4)
+
+    def test_missing_counters_are_seeded_by_real_count(self):
+        db.save_cards([make_card('card %d' % i, 'm14', 1.) for i in range(100)], shop='spellshop')
+        db.get_db().counters.remove()
+
+        db.save_cards([make_card('new card', 'm14', 1.)], shop='spellshop')
+        db.save_cards([make_card('other card', 'm13', 1.)], shop='spellshop')
+
+        self.assertEqual(db.get_cards_count('spellshop'), 102)
+        self.assertEqual(db.get_cards_count('spellshop', ['m14']), 101)
+        self.assertEqual(db.get_cards_count('spellshop', ['m13']), 1)
+
+    def test_counters_match_recount(self):
+        db.save_cards([make_card('a', 'm14', 1.), make_card('b', 'm14', 1.)], shop='spellshop')
+        db.save_cards([make_card('a', 'm14', 1., shop='buymagic')], shop='buymagic')
+        counted = [db.get_cards_count(shop, redas) for shop in ['spellshop', 'buymagic'] for redas in [None, ['m14']]]
+
+        db.reconcile_counters(['spellshop', 'buymagic'])
+
+        self.assertEqual([db.get_cards_count(shop, redas) for shop in ['spellshop', 'buymagic']
+                          for redas in [None, ['m14']]], counted)
+
+
+class RecomputeOverpayTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        card = make_card('a', 'm14', 0.)
+        card.shops['spellshop'].uah_price = 80.
+        card.refresh_overpay(8.)
+        db.save_cards([card], shop='spellshop')
+
+    def tearDown(self):
+        db.set_client(None)
+
+    def test_recompute_uses_stored_rate(self):
+        db.set_uah_rate(10.)
+
+        self.assertEqual(db.recompute_overpay(), {'cards': 1, 'modified': 1})
+
+        offer = db.get_card('a', 'm14').shops['spellshop']
+        self.assertEqual(offer.price, 8.)
+        self.assertEqual(offer.overpay, 1.875 / 8.)
+
+    def test_recompute_without_rate_change_writes_nothing(self):
+        db.set_uah_rate(8.)
+
+        self.assertEqual(db.recompute_overpay(), {'cards': 1, 'modified': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
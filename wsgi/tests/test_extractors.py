@@ -0,0 +1,224 @@
+# coding=utf-8
+import os
+import shutil
+import difflib
+import tempfile
+import unittest
+from bs4 import BeautifulSoup, Tag
+import ext
+import bench
+import extractors
+from fixtures import FixtureArchive
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as fixture:
+        return fixture.read()
+
+
+def legacy_magiccards_page(page):
+    """
+    Walks whole page tree the way magiccards scraper did before pages were extracted in one pass
+    """
+    soup = BeautifulSoup(page, extractors.HTML_PARSER)
+    if len(soup.find_all('table')) <= 2:
+        hints = tuple((hint_li.contents[0].text, hint_li.contents[0]['href']) for hint_li in soup.find_all('li'))
+        return extractors.MagiccardsPage(False, hints, None, None, (), None, None, None, None, None)
+
+    content_table = soup.find_all('table')[3]
+    redas_td = content_table.find_all('td')[2]
+    printings = tuple((reda_tag.text.strip().lower(), reda_tag['href']) for reda_tag in redas_td.find_all('a'))
+    en_link = list(redas_td.find('img', alt='English').next_elements)[1]
+    if en_link.name != 'b':
+        return extractors.MagiccardsPage(True, (), False, (en_link.text, en_link['href']), printings,
+                                         None, None, None, None, None)
+
+    redas_bs = redas_td.find_all('b')
+    reda_index = 3 if len(redas_bs) == 5 else 4
+    request_url = content_table.find_all('script')[0]['src']
+    return extractors.MagiccardsPage(
+        True, (), True, None, printings,
+        ext.uni(redas_bs[reda_index].text.split('(')[0]), ext.uni(redas_bs[reda_index].text.split('(')[1][:-1]),
+        ext.url_join(extractors.MAGICCARDS_BASE_URL, content_table.find_all('a')[0]['href']),
+        content_table.find_all('img')[0]['src'], ext.uni(ext.get_query_string_params(request_url)['sid']))
+
+
+def legacy_buymagic_rows(page, uah_rate):
+    """
+    Walks buymagic listing the way buymagic scraper did before rows were extracted
+    """
+    soup = BeautifulSoup(extractors.clean_buymagic_page(page), extractors.HTML_PARSER, from_encoding='utf-8')
+    root_div = soup.find('div', class_='c2')
+    rows = []
+    for card_div in filter(lambda r: isinstance(r, Tag), list(root_div.find('p').children))[:-1]:
+        card_div = card_div.find('div') or card_div
+        price_row = card_div.find('table').find('tr').find_all('td')
+        uah_price = ext.uah_to_float(ext.uni(price_row[1].text))
+        rows.append(extractors.ShopRow(ext.uni(card_div.find('a').text), ext.uni(card_div.find('a')['href']),
+                                       ext.price_to_float(ext.uah_to_dollar(ext.uni(price_row[1].text), uah_rate)),
+                                       len(price_row[2].find_all('option')), uah_price))
+    return rows
+
+
+class ExtractMagiccardsPageTest(unittest.TestCase):
+
+    def assert_same_as_legacy(self, name):
+        page = read_fixture(name)
+        extracted = extractors.extract_magiccards_page(page)
+        self.assertEqual(extracted, legacy_magiccards_page(page))
+        return extracted
+
+    def test_english_card_page(self):
+        extracted = self.assert_same_as_legacy('magiccards_card.html')
+
+        self.assertTrue(extracted.is_card)
+        self.assertTrue(extracted.is_en)
+        self.assertEqual(extracted.redaction, 'magic 2014')
+        self.assertEqual(extracted.rarity, 'common')
+        self.assertEqual(extracted.url, 'http://magiccards.info/m14/en/160.html')
+        self.assertEqual(extracted.img_url, 'http://magiccards.info/scans/en/m14/160.jpg')
+        self.assertEqual(extracted.sid, '68832')
+        self.assertIn(('magic 2013', '/m13/en/150.html'), extracted.printings)
+
+    def test_non_english_card_page_links_english_version(self):
+        extracted = self.assert_same_as_legacy('magiccards_card_de.html')
+
+        self.assertTrue(extracted.is_card)
+        self.assertFalse(extracted.is_en)
+        self.assertEqual(extracted.en_link, ('Shock', '/m14/en/160.html'))
+        self.assertIsNone(extracted.sid)
+
+    def test_double_faced_card_page(self):
+        extracted = self.assert_same_as_legacy('magiccards_card_dfc.html')
+
+        self.assertEqual(extracted.redaction, 'innistrad')
+        self.assertEqual(extracted.rarity, 'common')
+        self.assertEqual(extracted.url, 'http://magiccards.info/isd/en/51a.html')
+        self.assertEqual(extracted.sid, '50542')
+
+    def test_search_page_with_hints(self):
+        extracted = self.assert_same_as_legacy('magiccards_search.html')
+
+        self.assertFalse(extracted.is_card)
+        self.assertEqual(extracted.hints, (('Shock', '/query?q=%21shock&v=card&s=cname'),
+                                           ('Shoal', '/query?q=%21shoal&v=card&s=cname')))
+        # hint closest to searched name is picked as magiccards scraper did
+        best = max(extracted.hints, key=lambda hint: difflib.SequenceMatcher(a=u'shok', b=ext.uni(hint[0])).ratio())
+        self.assertEqual(best[0], 'Shock')
+
+
+class ExtractMagiccardsSetTest(unittest.TestCase):
+
+    def test_card_rows_are_extracted(self):
+        entries = extractors.extract_magiccards_set(read_fixture('magiccards_set.html'))
+
+        self.assertEqual([entry.name for entry in entries], ['shock', 'opt', "liliana's reaver"])
+        self.assertEqual(entries[2].title, u'liliana’s reaver')
+        self.assertEqual(entries[0].url, 'http://magiccards.info/m14/en/160.html')
+        self.assertEqual(entries[0].img_url, 'http://magiccards.info/scans/en/m14/160.jpg')
+        self.assertEqual(entries[2].rarity, 'rare')
+
+    def test_rows_with_unexpected_href_are_skipped(self):
+        titles = [entry.title for entry in extractors.extract_magiccards_set(read_fixture('magiccards_set.html'))]
+
+        self.assertNotIn('duress', titles)
+        self.assertNotIn('naturalize', titles)
+
+
+class ExtractTcgPricesTest(unittest.TestCase):
+
+    def test_prices_are_extracted(self):
+        prices = extractors.extract_tcg_prices(read_fixture('tcgplayer.js'), '68832')
+
+        self.assertEqual(prices, {'sid': '68832', 'url': 'http://store.tcgplayer.com/magic/magic-2014-core-set/shock',
+                                  'low': .05, 'mid': .19, 'high': 1.25})
+
+
+class ExtractSpellshopRowsTest(unittest.TestCase):
+
+    def test_rows_are_extracted(self):
+        rows = extractors.extract_spellshop_rows(read_fixture('spellshop_listing.html'), 8.)
+
+        self.assertEqual(rows, [
+            extractors.ShopRow(u'shock', 'http://spellshop.com.ua/index.php?productID=1601', 1.12, 4, 9.),
+            extractors.ShopRow(u'liliana’s reaver', 'http://spellshop.com.ua/index.php?productID=1602',
+                               3.06, 1, 24.5)])
+
+    def test_page_without_listing_has_no_rows(self):
+        self.assertEqual(extractors.extract_spellshop_rows('<html><body><p>empty</p></body></html>'), [])
+
+
+class ExtractBuymagicPageTest(unittest.TestCase):
+
+    def test_rows_and_pages_are_extracted(self):
+        page = read_fixture('buymagic_page.html')
+
+        pages, rows = extractors.extract_buymagic_page(page, with_pages=True, uah_rate=8.)
+
+        self.assertEqual(pages, ['http://www.buymagic.com.ua/catalog/m14/?page=2',
+                                 'http://www.buymagic.com.ua/catalog/m14/?page=3'])
+        self.assertEqual(rows, legacy_buymagic_rows(page, 8.))
+        self.assertEqual([(row.name, row.price, row.number) for row in rows],
+                         [(u'shock', 1., 3), (u'opt', .56, 1), (u"liliana's reaver", .01, 2)])
+
+    def test_pages_are_extracted_only_if_asked(self):
+        pages, rows = extractors.extract_buymagic_page(read_fixture('buymagic_page.html'), uah_rate=8.)
+
+        self.assertEqual(pages, [])
+        self.assertEqual(len(rows), 3)
+
+
+class ExtractRedasTest(unittest.TestCase):
+
+    def test_magiccards_english_redactions_are_extracted(self):
+        redas = extractors.extract_magiccards_redas(read_fixture('magiccards_sitemap.html'))
+
+        self.assertEqual(redas, [(u'magic 2014', 'http://magiccards.info/m14/en.html'),
+                                 (u'magic 2013', 'http://magiccards.info/m13/en.html'),
+                                 (u'innistrad', 'http://magiccards.info/isd/en.html')])
+
+    def test_spellshop_redactions_are_extracted_from_menu(self):
+        redas = extractors.extract_spellshop_redas(read_fixture('spellshop_menu.html'))
+
+        self.assertEqual(len(redas), 34)
+        self.assertEqual(redas[0], (u'magic 2014', 'http://spellshop.com.ua/index.php?categoryID=103'))
+        self.assertNotIn(u'распродажа', [name for name, url in redas])
+
+    def test_buymagic_redactions_are_extracted_from_menu(self):
+        redas = extractors.extract_buymagic_redas(read_fixture('buymagic_menu.html'))
+
+        self.assertEqual(redas, [(u'magic 2014', 'http://www.buymagic.com.ua/catalog/m14/'),
+                                 (u'magic 2013', 'http://www.buymagic.com.ua/catalog/m13/'),
+                                 (u'innistrad', 'http://www.buymagic.com.ua/catalog/isd/')])
+
+
+class ParseCostTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_only_magiccards_card_and_search_pages_are_measured(self):
+        archive = FixtureArchive()
+        archive.add('http://magiccards.info/m14/en/160.html', 200, {}, read_fixture('magiccards_card.html'))
+        archive.add('http://magiccards.info/m14/de/160.html', 200, {}, read_fixture('magiccards_card_de.html'))
+        archive.add('http://magiccards.info/query?q=!shok', 200, {}, read_fixture('magiccards_search.html'))
+        archive.add('http://magiccards.info/m14/en.html', 200, {}, read_fixture('magiccards_set.html'))
+        archive.add('http://www.buymagic.com.ua/catalog/m14/', 200, {}, read_fixture('buymagic_page.html'))
+        path = os.path.join(self.tmp_dir, 'fixture.zip')
+        archive.save(path)
+
+        result = bench.parse(path, repeat=2)
+
+        self.assertEqual(result['pages'], 3)
+        self.assertTrue(result['parse'] > 0)
+        self.assertTrue(result['extracted'] > 0)
+        self.assertTrue(result['walked'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+import httpcache
+import transport
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.bodies = {}
+        self.fetches = 0
+
+    def fetch(self, url, headers):
+        self.fetches += 1
+        return transport.Response(url, 200, 'OK', {}, self.bodies[url])
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = httpcache.ResponseCache(self.root, [(r'^http://listing/', 0), (r'^http://card/', 60)])
+        self.transport = FakeTransport()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def bodies(self):
+        return sorted(name for directory, dirs, names in os.walk(os.path.join(self.root, 'bodies')) for name in names)
+
+    def test_fresh_entry_is_served_with_its_fetch_time(self):
+        self.transport.bodies['http://card/1'] = 'card'
+        body, fetched = self.cache.fetch_with_time(self.transport, 'http://card/1', {})
+
+        self.assertEqual(self.cache.fetch_with_time(self.transport, 'http://card/1', {}), (body, fetched))
+        self.assertEqual(self.transport.fetches, 1)
+
+    def test_entry_older_than_max_age_is_refetched(self):
+        self.transport.bodies['http://card/1'] = 'card'
+        self.cache.fetch(self.transport, 'http://card/1', {})
+
+        self.cache.fetch_with_time(self.transport, 'http://card/1', {}, max_age=60)
+        self.assertEqual(self.transport.fetches, 1)
+        body, fetched = self.cache.fetch_with_time(self.transport, 'http://card/1', {}, max_age=0)
+        self.assertEqual(self.transport.fetches, 2)
+
+    def test_garbage_collection_deletes_only_unreferenced_bodies(self):
+        self.transport.bodies['http://listing/1'] = 'old listing'
+        self.cache.fetch(self.transport, 'http://listing/1', {})
+        self.transport.bodies['http://card/1'] = 'card'
+        self.cache.fetch(self.transport, 'http://card/1', {})
+        self.transport.bodies['http://listing/1'] = 'new listing'
+        self.cache.fetch(self.transport, 'http://listing/1', {})
+        self.assertEqual(len(self.bodies()), 3)
+
+        self.assertEqual(self.cache.collect_garbage(min_age=0), 1)
+
+        self.assertEqual(len(self.bodies()), 2)
+        self.assertEqual(self.cache.fetch(self.transport, 'http://card/1', {}), 'card')
+
+    def test_garbage_collection_keeps_young_bodies(self):
+        self.transport.bodies['http://listing/1'] = 'old listing'
+        self.cache.fetch(self.transport, 'http://listing/1', {})
+        self.transport.bodies['http://listing/1'] = 'new listing'
+        self.cache.fetch(self.transport, 'http://listing/1', {})
+
+        self.assertEqual(self.cache.collect_garbage(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
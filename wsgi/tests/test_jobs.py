@@ -0,0 +1,59 @@
+import unittest
+import mongomock
+import db
+import jobs
+import models
+import scrapers
+
+
+class FailingScraper(object):
+    SHOP_NAME = 'spellshop'
+
+
+class RunJobTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        db.save_redas([models.Redaction('m14', 'http://mc/m14', [], shops={'spellshop': 'http://shop/m14'})])
+        self.save_shops_cards = scrapers.save_shops_cards
+
+    def tearDown(self):
+        scrapers.save_shops_cards = self.save_shops_cards
+        db.set_client(None)
+
+    def test_failed_redaction_error_is_stored_on_job(self):
+        def fail(shops, reda, checkpoint=None):
+            raise IOError('listing is down')
+        scrapers.save_shops_cards = fail
+
+        jobs.submit('cards', shop='spellshop')
+        job = db.claim_job('test')
+        jobs.run_job(job, [FailingScraper])
+
+        status = jobs.status(db.get_job(str(job['_id'])))
+        self.assertEqual(status['progress']['errors'], 1)
+        self.assertEqual(status['errors'][0]['redaction'], 'm14')
+        self.assertIn('listing is down', status['errors'][0]['error'])
+
+    def test_resumed_job_keeps_freshness_of_checkpointed_redaction(self):
+        def save(shops, reda, checkpoint=None):
+            return {}
+        scrapers.save_shops_cards = save
+
+        jobs.submit('cards', shop='spellshop')
+        job = db.claim_job('test')
+        jobs.run_job(job, [FailingScraper])
+
+        self.assertEqual(db.get_freshness(), {})
+        self.assertEqual(jobs.status(db.get_job(str(job['_id'])))['progress']['redas_done'], 1)
+
+    def test_duplicate_jobs_are_merged(self):
+        first = jobs.submit('cards', shop='spellshop', reda='m14')
+        second = jobs.submit('cards', shop='spellshop', reda='m14')
+
+        self.assertEqual(first['_id'], second['_id'])
+        self.assertEqual(second['requests'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import time
+import unittest
+import eventlet
+import parsing
+
+
+def slow_square(value):
+    time.sleep(.05)
+    return value * value
+
+
+def fail(value):
+    raise ValueError(value)
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workers = parsing.PARSE_WORKERS
+        parsing.PARSE_WORKERS = 2
+
+    def tearDown(self):
+        parsing.close()
+        parsing.PARSE_WORKERS = self.workers
+
+    def test_waiting_for_workers_doesnt_block_hub(self):
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(time.time())
+                eventlet.sleep(.01)
+
+        ticker = eventlet.spawn(tick)
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(lambda value: parsing.run(slow_square, value), range(6)))
+        ticker.kill()
+
+        self.assertEqual(results, [0, 1, 4, 9, 16, 25])
+        # 6 calls at 2 workers take ~.15s, ticker runs all that time
+        self.assertTrue(len(ticks) >= 5)
+
+    def test_worker_exception_is_raised_in_caller(self):
+        self.assertRaises(ValueError, parsing.run, fail, 1)
+
+    def test_closed_pool_is_created_again(self):
+        self.assertEqual(parsing.run(slow_square, 3), 9)
+        parsing.close()
+
+        self.assertEqual(parsing.run(slow_square, 4), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import datetime
+import unittest
+import mongomock
+import db
+import models
+import refresh
+
+
+class FakeShop(object):
+    SHOP_NAME = 'spellshop'
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        db.save_redas([models.Redaction(name, 'http://mc/' + name, [], shops={'spellshop': 'http://shop/' + name})
+                       for name in ('m14', 'm13', 'm12', 'm11')])
+
+    def tearDown(self):
+        db.set_client(None)
+
+    def set_freshness(self, reda, hours_ago, cost, volatility=0.):
+        db.get_db().freshness.insert({'_id': 'spellshop:' + reda, 'shop': 'spellshop', 'redaction': reda,
+                                      'refreshed': datetime.datetime.utcnow() - datetime.timedelta(hours=hours_ago),
+                                      'cost': cost, 'volatility': volatility, 'max_overpay': 0.})
+
+    def test_most_urgent_listings_fit_into_budget(self):
+        self.set_freshness('m14', 48, 30, volatility=1.)
+        self.set_freshness('m13', 48, 30)
+        self.set_freshness('m12', 24, 10)
+        self.set_freshness('m11', 0, 1)
+
+        planned = refresh.plan([FakeShop], 45)
+
+        # m13 doesn't fit after m14, cheaper and less urgent m12 does, m11 was just refreshed
+        self.assertEqual([reda for shop, reda, urgency, cost in planned], ['m14', 'm12'])
+        self.assertTrue(sum(cost for shop, reda, urgency, cost in planned) <= 45)
+
+    def test_never_refreshed_listing_goes_first_with_default_cost(self):
+        for reda in ('m14', 'm13', 'm12'):
+            self.set_freshness(reda, 48, 1)
+
+        planned = refresh.plan([FakeShop], refresh.DEFAULT_COST)
+
+        self.assertEqual(planned[0][1], 'm11')
+        self.assertEqual(planned[0][3], refresh.DEFAULT_COST)
+        self.assertEqual(len(planned), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
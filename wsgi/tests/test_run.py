@@ -0,0 +1,37 @@
+import unittest
+import mongomock
+import db
+import run
+
+
+class CachedPageTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        run.pages_cache.clear()
+        self.client = run.app.test_client()
+
+    def tearDown(self):
+        db.set_client(None)
+
+    def test_gzipped_and_plain_pages_have_different_etags(self):
+        plain = self.client.get('/redactions')
+        gzipped = self.client.get('/redactions', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertNotEqual(plain.headers['ETag'], gzipped.headers['ETag'])
+
+    def test_etag_of_other_encoding_doesnt_revalidate(self):
+        plain_etag = self.client.get('/redactions').headers['ETag']
+
+        revalidated = self.client.get('/redactions', headers={'If-None-Match': plain_etag})
+        other = self.client.get('/redactions', headers={'If-None-Match': plain_etag, 'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(other.headers['Content-Encoding'], 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
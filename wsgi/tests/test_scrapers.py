@@ -0,0 +1,291 @@
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import unittest
+import eventlet
+import mongomock
+import checkpoints
+import db
+import extractors
+import httpcache
+import models
+import parsing
+import scrapers
+from tests.test_db import make_card
+from tests.test_httpcache import FakeTransport
+
+
+class FakeShop(object):
+    """
+    Shop scraper which listing is set by test, fetched pages and parsed rows are recorded
+    """
+    SHOP_NAME = 'spellshop'
+    listing = {}
+    fetched = []
+    parsed = []
+
+    @staticmethod
+    def get_listing(reda):
+        return [(url, None) for url in sorted(FakeShop.listing)]
+
+    @staticmethod
+    def get_page_rows(url):
+        FakeShop.fetched.append(url)
+        return FakeShop.listing[url]
+
+    @staticmethod
+    def _parse_card_shop_info((row, resolver)):
+        FakeShop.parsed.append(row.name)
+        prices = models.CardPrices('1', 'http://tcg/' + row.name, 1., 2., 3.)
+        card = models.Card(row.name, resolver.reda_name, 'common',
+                           info=models.CardInfo('http://mc/' + row.name, 'http://mc/img'), prices=prices)
+        card.shops[FakeShop.SHOP_NAME] = models.Shop(row.name, row.url, row.price, 1., row.number)
+        return card
+
+
+def make_row(name, price=1.):
+    return extractors.ShopRow(name, 'http://shop/' + name.replace(' ', '-'), price, 1, None)
+
+
+class StreamMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.finished = []
+
+    def slow_square(self, item):
+        eventlet.sleep(0.001 * (item % 3))
+        self.finished.append(item)
+        return item * item
+
+    def test_yields_all_results(self):
+        with eventlet.Timeout(5):
+            results = list(scrapers.stream_map(self.slow_square, xrange(100), size=4))
+
+        self.assertEqual(sorted(results), [item * item for item in xrange(100)])
+
+    def test_closed_consumer_waits_for_spawned_calls(self):
+        with eventlet.Timeout(5):
+            stream = scrapers.stream_map(self.slow_square, xrange(100), size=4)
+            taken = [next(stream) for _ in xrange(3)]
+            stream.close()
+
+        self.assertEqual(len(taken), 3)
+        # no more than in flight and queued calls are run after consumer stops
+        self.assertTrue(len(self.finished) <= 3 + 4 + 4)
+        finished = len(self.finished)
+        eventlet.sleep(0.01)
+        self.assertEqual(len(self.finished), finished)
+
+    def test_call_exception_is_raised_in_consumer_and_stream_is_drained(self):
+        def fail_on_five(item):
+            if item == 5:
+                raise ValueError(item)
+            return self.slow_square(item)
+
+        with eventlet.Timeout(5):
+            self.assertRaises(ValueError, list, scrapers.stream_map(fail_on_five, xrange(100), size=4))
+
+    def test_items_exception_is_raised_in_consumer(self):
+        def items():
+            for item in xrange(10):
+                yield item
+            raise IOError('listing page is down')
+
+        with eventlet.Timeout(5):
+            self.assertRaises(IOError, list, scrapers.stream_map(self.slow_square, items(), size=4))
+
+    def test_results_queue_full_when_consumer_stops(self):
+        # calls finish instantly, so they block on full queue before consumer closes stream
+        with eventlet.Timeout(5):
+            stream = scrapers.stream_map(lambda item: item, xrange(1000), size=2)
+            next(stream)
+            eventlet.sleep(0.01)
+            stream.close()
+
+
+class SaveShopsCardsTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        self.reda = models.Redaction('m14', 'http://mc/m14', [], shops={'spellshop': 'http://shop/m14'})
+        FakeShop.listing = {'http://shop/m14/1': [make_row('shock'), make_row('opt')],
+                            'http://shop/m14/2': [make_row('duress')]}
+        FakeShop.fetched, FakeShop.parsed = [], []
+
+    def tearDown(self):
+        db.set_client(None)
+
+    def test_resumed_run_skips_checkpointed_pages(self):
+        checkpoint = checkpoints.Checkpoint('run')
+        checkpoint.page_done('spellshop', 'http://shop/m14/1')
+
+        reports = scrapers.save_shops_cards([FakeShop], self.reda, checkpoints.Checkpoint('run'))
+
+        self.assertEqual(FakeShop.fetched, ['http://shop/m14/2'])
+        self.assertEqual(FakeShop.parsed, ['duress'])
+        self.assertEqual(reports['spellshop']['new'], 1)
+        self.assertEqual([name for name, _ in db.get_offer_fingerprints('spellshop', 'm14').values()], ['duress'])
+        self.assertTrue(checkpoints.Checkpoint('run').is_reda_done('spellshop', 'm14'))
+
+    def test_resumed_run_skips_checkpointed_redaction(self):
+        scrapers.save_shops_cards([FakeShop], self.reda, checkpoints.Checkpoint('run'))
+        FakeShop.fetched, FakeShop.parsed = [], []
+
+        reports = scrapers.save_shops_cards([FakeShop], self.reda, checkpoints.Checkpoint('run'))
+
+        self.assertEqual(reports, {})
+        self.assertEqual(FakeShop.fetched, [])
+        self.assertEqual(FakeShop.parsed, [])
+
+    def test_partial_run_doesnt_remove_offers(self):
+        scrapers.save_shops_cards([FakeShop], self.reda)
+        checkpoint = checkpoints.Checkpoint('run')
+        checkpoint.page_done('spellshop', 'http://shop/m14/1')
+        del FakeShop.listing['http://shop/m14/2']
+        FakeShop.listing['http://shop/m14/3'] = []
+
+        reports = scrapers.save_shops_cards([FakeShop], self.reda, checkpoints.Checkpoint('run'))
+
+        self.assertEqual(reports['spellshop']['delisted'], 0)
+        self.assertEqual(len(db.get_offer_fingerprints('spellshop', 'm14')), 3)
+
+    def test_offers_not_listed_anymore_are_removed(self):
+        scrapers.save_shops_cards([FakeShop], self.reda)
+        FakeShop.listing['http://shop/m14/1'] = [make_row('shock')]
+
+        reports = scrapers.save_shops_cards([FakeShop], self.reda)
+
+        self.assertEqual(reports['spellshop']['delisted'], 1)
+        self.assertEqual(reports['spellshop']['unchanged'], 2)
+        self.assertEqual(sorted(name for name, _ in db.get_offer_fingerprints('spellshop', 'm14').values()),
+                         ['duress', 'shock'])
+        self.assertEqual(db.get_cards_count('spellshop', ['m14']), 2)
+
+    def test_offer_with_changed_url_is_kept(self):
+        scrapers.save_shops_cards([FakeShop], self.reda)
+        moved = extractors.ShopRow('opt', 'http://shop/opt-foil', 1., 1, None)
+        FakeShop.listing['http://shop/m14/1'] = [make_row('shock'), moved]
+
+        reports = scrapers.save_shops_cards([FakeShop], self.reda)
+
+        self.assertEqual(reports['spellshop']['delisted'], 0)
+        self.assertEqual(db.get_offer_fingerprints('spellshop', 'm14')[moved.url][0], 'opt')
+        self.assertEqual(db.get_cards_count('spellshop', ['m14']), 3)
+
+
+class CardResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        db.save_card_failure('shock', 'm14', 'not found')
+        self.find_card = scrapers.MagiccardsScraper.find_card
+        self.searched = []
+
+        def find_card(name, redaction):
+            self.searched.append(name)
+            return None, 'not found'
+        scrapers.MagiccardsScraper.find_card = staticmethod(find_card)
+
+    def tearDown(self):
+        scrapers.MagiccardsScraper.find_card = staticmethod(self.find_card)
+        db.set_client(None)
+
+    def test_stored_failures_are_skipped_and_new_ones_stored(self):
+        resolver = scrapers.CardResolver('m14')
+
+        self.assertIsNone(resolver.resolve('shock'))
+        self.assertIsNone(resolver.resolve('opt'))
+
+        self.assertEqual(self.searched, ['opt'])
+        self.assertEqual(sorted(db.get_card_failures(['m14'])), [('opt', 'm14'), ('shock', 'm14')])
+
+    def test_resolver_with_injected_state_doesnt_touch_db(self):
+        resolver = scrapers.CardResolver('m14', known_cards={}, failures={}, catalog={}, persist=False)
+
+        self.assertIsNone(resolver.resolve('shock'))
+        self.assertIsNone(resolver.resolve('opt'))
+
+        self.assertEqual(self.searched, ['shock', 'opt'])
+        self.assertEqual(sorted(db.get_card_failures(['m14'])), [('shock', 'm14')])
+
+
+class BuildCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        self.get_catalog = scrapers.MagiccardsScraper.get_catalog
+
+        def get_catalog(reda):
+            if reda.name == 'm13':
+                raise IOError('set listing is down')
+            return [extractors.CatalogEntry('shock', 'Shock', 'http://mc/shock', 'http://mc/img', 'Common')]
+        scrapers.MagiccardsScraper.get_catalog = staticmethod(get_catalog)
+
+    def tearDown(self):
+        scrapers.MagiccardsScraper.get_catalog = staticmethod(self.get_catalog)
+        db.set_client(None)
+
+    def test_failed_redaction_doesnt_stop_others(self):
+        redas = [models.Redaction(name, 'http://mc/' + name, []) for name in ('m14', 'm13', 'm12')]
+
+        result = scrapers.build_catalog(redas)
+
+        self.assertEqual(result['saved'], 2)
+        self.assertEqual(result['failed'].keys(), ['m13'])
+        self.assertEqual(sorted(reda for name, reda in db.get_catalog(['m14', 'm13', 'm12'])), ['m12', 'm14'])
+
+
+class RefreshPricesTest(unittest.TestCase):
+
+    def setUp(self):
+        db.set_client(mongomock.MongoClient())
+        card = make_card('shock', 'm14', 1.)
+        card.prices = models.CardPrices('68832', 'http://tcg/shock', 1., 2., 3.,
+                                        datetime.datetime.utcnow() - datetime.timedelta(hours=3))
+        db.save_cards([card])
+
+        self.root = tempfile.mkdtemp()
+        self.transport = FakeTransport()
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'tcgplayer.js'), 'rb') as fixture:
+            self.transport.bodies[scrapers.TCGPlayerScraper('68832').brief_url] = fixture.read()
+        self.saved = scrapers.http, scrapers.responses_cache, parsing.PARSE_WORKERS
+        scrapers.http, scrapers.responses_cache = self.transport, httpcache.ResponseCache(self.root)
+        parsing.PARSE_WORKERS = 0
+
+    def tearDown(self):
+        scrapers.http, scrapers.responses_cache, parsing.PARSE_WORKERS = self.saved
+        shutil.rmtree(self.root)
+        db.set_client(None)
+
+    def cache_response(self, age):
+        url = scrapers.TCGPlayerScraper('68832').brief_url
+        scrapers.responses_cache.fetch(self.transport, url, {})
+        entry = scrapers.responses_cache._load_entry(url)
+        entry['fetched'] = time.time() - age
+        scrapers.responses_cache._save_entry(url, entry)
+        self.transport.fetches = 0
+
+    def test_cached_response_older_than_max_age_is_refetched(self):
+        self.cache_response(2 * 60 * 60)
+
+        result = scrapers.refresh_prices(60 * 60, 10)
+
+        self.assertEqual(self.transport.fetches, 1)
+        self.assertEqual(result, {'fetched': 1, 'failed': 0, 'updated': 1})
+        self.assertEqual(db.get_stale_cards(60 * 60, 10), [])
+
+    def test_cached_response_younger_than_max_age_isnt_counted_as_fetch(self):
+        self.cache_response(10 * 60)
+
+        result = scrapers.refresh_prices(60 * 60, 10)
+
+        self.assertEqual(self.transport.fetches, 0)
+        self.assertEqual(result, {'fetched': 0, 'failed': 0, 'updated': 1})
+        self.assertEqual(db.get_card('shock', 'm14').prices.mid, .19)
+        self.assertEqual(db.get_stale_cards(60 * 60, 10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
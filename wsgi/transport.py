@@ -0,0 +1,233 @@
+import os
+import time
+import zlib
+import socket
+import urlparse
+from collections import defaultdict
+from eventlet.green import httplib
+import scheduler as fetch_scheduler
+
+HTTP_TIMEOUT = float(os.environ.get('PRICES_HTTP_TIMEOUT', 30))
+HTTP_POOL_SIZE = int(os.environ.get('PRICES_HTTP_POOL_SIZE', 20))
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 16 * 1024
+
+
+class FetchError(IOError):
+    """
+    Raised when server answers with unexpected status
+    """
+
+    def __init__(self, url, status, reason):
+        super(FetchError, self).__init__('%s %s: %s' % (status, reason, url))
+        self.url = url
+        self.status = status
+
+
+class Response(object):
+    """
+    Fetched resource with decoded body
+    """
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def __repr__(self):
+        return '%s %s' % (self.status, self.url)
+
+
+class HostPool(object):
+    """
+    Keep-alive connections to one host, connections are created on demand
+    and at most max_size idle connections are kept for reuse.
+    Host and port are address that is connected, it may differ from url host
+    """
+
+    def __init__(self, scheme, host, port, max_size, timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+
+    def get(self):
+        """Returns idle connection or creates new one
+
+        :return: tuple (httplib.HTTPConnection, is connection reused)
+        """
+        if self._idle:
+            return self._idle.pop(), True
+
+        conn_class = httplib.HTTPSConnection if self.scheme == 'https' else httplib.HTTPConnection
+        return conn_class(self.host, self.port, timeout=self.timeout), False
+
+    def put(self, conn):
+        """
+        Returns connection to the pool or closes it if pool is full
+        """
+        if len(self._idle) < self.max_size:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """
+        Closes idle connections of the pool
+        """
+        while self._idle:
+            self._idle.pop().close()
+
+
+class Transport(object):
+    """
+    HTTP client with per-host keep-alive pools, follows redirects
+    and decodes gzip/deflate bodies while reading them.
+    Every request waits for its host slot in scheduler.
+    If connect_to address is set, all requests are sent to it with original Host header
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT, scheduler=None, connect_to=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.scheduler = scheduler if scheduler is not None else fetch_scheduler.Scheduler()
+        self.connect_to = connect_to
+        self.stats = defaultdict(lambda: {'fetches': 0, 'connects': 0, 'reuses': 0, 'errors': 0,
+                                          'bytes': 0, 'seconds': 0.})
+        self._pools = {}
+
+    def fetch(self, url, headers=None):
+        """Fetches url, redirects are followed, statuses other than 2xx and 304 raise FetchError
+
+        :param url: ascii url
+        :param headers: dict of request headers
+        :return: transport.Response
+        """
+        for _ in xrange(MAX_REDIRECTS + 1):
+            response = self._fetch_once(url, headers or {})
+            if response.status in (301, 302, 303, 307) and 'location' in response.headers:
+                url = urlparse.urljoin(url, response.headers['location'])
+                continue
+
+            if not (200 <= response.status < 300 or response.status == 304):
+                self.stats[urlparse.urlsplit(url).hostname]['errors'] += 1
+                raise FetchError(url, response.status, response.reason)
+
+            return response
+
+        raise FetchError(url, response.status, 'too many redirects')
+
+    def _fetch_once(self, url, headers):
+        """
+        Makes one request, stale reused connection is replaced by new one
+        """
+        parts = urlparse.urlsplit(url)
+        pool = self._get_pool(parts)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if self.connect_to is not None:
+            headers = dict(headers, Host=parts.netloc)
+
+        stats = self.stats[parts.hostname]
+        stats['fetches'] += 1
+        limiter = self.scheduler.acquire(parts.hostname)
+        started = time.time()
+        failed = True
+        try:
+            while True:
+                conn, reused = pool.get()
+                stats['reuses' if reused else 'connects'] += 1
+                try:
+                    conn.request('GET', path, headers=headers)
+                    raw = conn.getresponse()
+                    body = self._read_body(raw)
+                    break
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if reused:
+                        continue
+                    stats['errors'] += 1
+                    raise
+            failed = raw.status in fetch_scheduler.THROTTLE_STATUSES
+        finally:
+            limiter.release(time.time() - started, failed)
+
+        if raw.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+
+        stats['bytes'] += len(body)
+        stats['seconds'] += time.time() - started
+        return Response(url, raw.status, raw.reason, dict(raw.getheaders()), body)
+
+    def _get_pool(self, parts):
+        key = (parts.scheme, parts.hostname, parts.port)
+        if key not in self._pools:
+            host, port = self.connect_to if self.connect_to is not None else (parts.hostname, parts.port)
+            self._pools[key] = HostPool(parts.scheme, host, port, self.pool_size, self.timeout)
+
+        return self._pools[key]
+
+    @staticmethod
+    def _read_body(raw):
+        """Reads response body chunk by chunk decoding it on the fly
+
+        :param raw: httplib.HTTPResponse
+        :return: decoded body as string
+        """
+        encoding = (raw.getheader('content-encoding') or '').lower()
+        decoder = None
+        if encoding == 'gzip':
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            decoder = DeflateDecoder()
+
+        chunks = []
+        while True:
+            chunk = raw.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(decoder.decompress(chunk) if decoder else chunk)
+
+        if decoder:
+            chunks.append(decoder.flush())
+
+        return ''.join(chunks)
+
+    def close(self):
+        """
+        Closes idle connections of all hosts pools
+        """
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+
+class DeflateDecoder(object):
+    """
+    Decodes deflate stream, both zlib wrapped and raw streams are accepted
+    """
+
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._decoder.decompress(data)
+
+        self._first = False
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data)
+
+    def flush(self):
+        return self._decoder.flush()